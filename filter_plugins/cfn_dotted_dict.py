@@ -1,27 +1,66 @@
-from functools import reduce
-import operator
-import json
+from ansible.errors import AnsibleError
+import copy
 import re
-from collections import defaultdict
 
 class FilterModule(object):
   ''' Converts CloudFormation Template Parameters to Stack Input mappings '''
   def filters(self):
     return {
-      'cfn_dotted_dict': cfn_dotted_dict
+      'cfn_dotted_dict': cfn_dotted_dict,
+      'cfn_dotted_dicts': cfn_dotted_dicts
     }
 
-def cfn_dotted_dict(vars, paths=[]):
-  infinitedict = lambda: defaultdict(infinitedict)
-  data = infinitedict()
-  vars_keys = list(vars.keys())
-  vars_keys.sort(key=len)
-  params = [(k,vars[k]) for p in paths for k in vars_keys if k.startswith(p) ]
-  for param in params:
+SELECTOR = re.compile(r'[\[\]\*]+')
+UNSET = object()
+
+# Builds a prefix trie of dotted variables for each group of paths in a single pass of the variable names
+# Each trie node is a list in form [value, children]
+# Only the values of variables that match a path are looked up, as Ansible templates each host variable on lookup
+def dotted_tries(vars, groups):
+  tries = [[UNSET, {}] for _ in groups]
+  prefixes = [tuple(paths) for paths in groups]
+  for key in list(vars.keys()):
     # Only process params with dotted syntax,others are processed by stack_overrides
-    if re.search('[\[\]\*]+',param[0]):
+    if SELECTOR.search(key):
       continue
-    keys = param[0].split('.')
-    parent = reduce(operator.getitem, keys[:-1], data)
-    parent[keys[-1]] = param[1]
-  return json.loads(json.dumps(data))
+    matches = [trie for trie, paths in zip(tries, prefixes) if key.startswith(paths)]
+    if not matches:
+      continue
+    value = vars[key]
+    for trie in matches:
+      node = trie
+      for part in key.split('.'):
+        node = node[1].setdefault(part, [UNSET, {}])
+      node[0] = value
+  return tries
+
+# Emits a trie node as a plain dictionary tree
+# Dotted children are merged into a parent dictionary value, any other parent value is a conflict
+def dotted_tree(node, base, path, conflicts):
+  value = node[0] if node[0] is not UNSET else base
+  if not node[1]:
+    return copy.deepcopy(value)
+  if value is UNSET:
+    data = {}
+  elif isinstance(value, dict):
+    data = copy.deepcopy(value)
+  else:
+    conflicts.extend("%s (%s) and %s.%s" % ('.'.join(path), type(value).__name__, '.'.join(path), key) for key in node[1])
+    return value
+  for key, child in node[1].items():
+    data[key] = dotted_tree(child, data.get(key, UNSET), path + [key], conflicts)
+  return data
+
+def dotted_trees(vars, groups):
+  conflicts = []
+  trees = [dotted_tree(trie, {}, [], conflicts) for trie in dotted_tries(vars, groups)]
+  if conflicts:
+    raise AnsibleError("Conflicting dotted variable assignments: %s" % ', '.join(sorted(set(conflicts))))
+  return trees
+
+def cfn_dotted_dict(vars, paths=[]):
+  return dotted_trees(vars, [paths])[0]
+
+# Returns a separate dotted dictionary tree for each path, e.g. ['Stack.','Config.','AWS::']
+def cfn_dotted_dicts(vars, paths=[]):
+  return dotted_trees(vars, [[p] for p in paths])
@@ -1,3 +1,18 @@
+from ansible.errors import AnsibleFilterError
+from collections import OrderedDict
+import json
+
+try:
+  import netaddr
+  HAS_NETADDR = True
+except ImportError:
+  HAS_NETADDR = False
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
 class FilterModule(object):
   ''' Transforms security rule expressions to AWS security group syntax '''
   def filters(self):
@@ -5,6 +20,10 @@ class FilterModule(object):
         'security_rules': security_rules
     }
 
+# Protocols with port ranges that can be merged (ICMP types and codes are not ranges)
+PORT_RANGE_PROTOCOLS = ['tcp', 'udp', '6', '17']
+ALL_PROTOCOLS = '-1'
+
 def parse(port_expr):
     if str(port_expr).lstrip('-').isdigit():
       protocol = 'tcp'
@@ -19,13 +38,107 @@ def parse(port_expr):
         protocol = 'tcp'
     return (protocol,from_port,to_port)
 
-def security_rules(rules):  
+# Returns the normalized protocol and port range of a port expression for compaction
+# Port expressions without a protocol (e.g. 80 or 82-90) are tcp, and -1 is all protocols
+def compact_port(port_expr):
+  if str(port_expr).strip() == ALL_PROTOCOLS:
+    return (ALL_PROTOCOLS, -1, -1)
+  protocol, from_port, to_port = parse(port_expr)
+  if '/' not in str(port_expr):
+    protocol = 'tcp'
+  return (str(protocol).lower(), int(from_port), int(to_port))
+
+def rule(protocol, from_port, to_port, cidr_ip):
+  return {
+    'IpProtocol': protocol,
+    'FromPort': from_port,
+    'ToPort': to_port,
+    'CidrIp': cidr_ip
+  }
+
+# Merges overlapping and adjacent port ranges
+def merge_ranges(ranges):
+  merged = []
+  for from_port, to_port in sorted(ranges):
+    if merged and from_port <= merged[-1][1] + 1:
+      merged[-1] = (merged[-1][0], max(merged[-1][1], to_port))
+    else:
+      merged.append((from_port, to_port))
+  return merged
+
+# Aggregates literal CIDRs into supernets, and removes duplicate CIDRs that are intrinsic functions (e.g. Fn::ImportValue)
+def merge_cidrs(cidrs):
+  functions = OrderedDict((json.dumps(c, sort_keys=True), c) for c in cidrs if not isinstance(c, basestring))
+  return [str(cidr) for cidr in netaddr.cidr_merge([c for c in cidrs if isinstance(c, basestring)])] + list(functions.values())
+
+def group(pairs, index):
+  groups = OrderedDict()
+  for pair in pairs:
+    groups.setdefault(json.dumps(pair[index], sort_keys=True), (pair[index], []))[1].append(pair[1 - index])
+  return groups.values()
+
+# Returns the minimal rules for a list of (port range, CIDR) pairs of a protocol
+# CIDRs are aggregated per port range and port ranges are merged per CIDR, until neither reduces the number of rules
+def compact_protocol_rules(protocol, pairs):
+  count = None
+  while count != len(pairs):
+    count = len(pairs)
+    pairs = [(port_range, cidr_ip) for port_range, cidrs in group(pairs, 0) for cidr_ip in merge_cidrs(cidrs)]
+    if protocol in PORT_RANGE_PROTOCOLS:
+      pairs = [(port_range, cidr_ip) for cidr_ip, port_ranges in group(pairs, 1) for port_range in merge_ranges(port_ranges)]
   return [
-    {
-      'IpProtocol': parse(port_expr)[0],
-      'FromPort': parse(port_expr)[1], 
-      'ToPort': parse(port_expr)[2], 
-      'CidrIp': cidr_ip
-    } 
-    for rule in rules for cidr_ip in rule['CidrIp'] for port_expr in rule['Ports']
-  ]
\ No newline at end of file
+    rule(protocol, port_range[0], port_range[1], cidr_ip)
+    for port_range, cidrs in sorted(group(pairs, 0), key=lambda g: g[0])
+    for cidr_ip in merge_cidrs(cidrs)
+  ]
+
+# Raises an error for a literal CIDR of a rule that cannot be aggregated
+def validate_cidr(cidr_ip, r):
+  if isinstance(cidr_ip, basestring):
+    try:
+      netaddr.IPNetwork(cidr_ip)
+    except (netaddr.AddrFormatError, ValueError, TypeError) as e:
+      raise AnsibleFilterError("Invalid CIDR %s in security rule %s: %s" % (cidr_ip, json.dumps(r, sort_keys=True), e))
+
+# Returns the minimal equivalent rules of a list of security rule expressions, with each port expression parsed once
+def compact_rules(rules):
+  if not HAS_NETADDR:
+    raise AnsibleFilterError('The security_rules filter requires python-netaddr be installed on the ansible controller to compact rules')
+  protocols = OrderedDict()
+  for r in rules:
+    ports = [compact_port(port_expr) for port_expr in r['Ports']]
+    for cidr_ip in r['CidrIp']:
+      validate_cidr(cidr_ip, r)
+      for protocol, from_port, to_port in ports:
+        protocols.setdefault(protocol, []).append(((from_port, to_port), cidr_ip))
+  return [
+    compacted
+    for protocol, pairs in protocols.items()
+    for compacted in compact_protocol_rules(protocol, pairs)
+  ]
+
+# Expands security rule expressions to security group rules for each CIDR and port expression
+# If compact is true, overlapping and adjacent port ranges are merged per protocol and CIDRs are aggregated into supernets.
+# Port expressions without a protocol are compacted as tcp and -1 as all protocols
+# If a report dictionary is provided, the number of expanded, compacted and saved rules are added to the report
+def security_rules(rules, compact=False, report=None):
+  if compact:
+    result = compact_rules(rules)
+  else:
+    ports = {}
+    for r in rules:
+      for port_expr in r['Ports']:
+        if port_expr not in ports:
+          ports[port_expr] = parse(port_expr)
+    result = [
+      rule(*(ports[port_expr] + (cidr_ip,)))
+      for r in rules for cidr_ip in r['CidrIp'] for port_expr in r['Ports']
+    ]
+  if report is not None:
+    expanded = sum(len(r['CidrIp']) * len(r['Ports']) for r in rules)
+    report.update({
+      'Rules': expanded,
+      'Compacted': len(result),
+      'Saved': expanded - len(result)
+    })
+  return result
@@ -0,0 +1,24 @@
+import hashlib
+import json
+
+class FilterModule(object):
+  ''' Computes a content fingerprint of stack inputs, and the size and digest of generated content '''
+  def filters(self):
+    return {
+      'stack_fingerprint': stack_fingerprint,
+      'content_digest': content_digest
+    }
+
+# Returns a SHA-256 fingerprint of data
+# Data is serialized with sorted keys so that the fingerprint is independent of dictionary ordering
+def stack_fingerprint(data):
+  return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',',':'), default=str).encode('utf-8')).hexdigest()
+
+# Returns the UTF-8 encoded size in bytes and MD5 digest of content, e.g. a serialized template
+# The MD5 digest matches the S3 key of templates uploaded by 'aws cloudformation deploy'
+def content_digest(content):
+  body = content.encode('utf-8') if not isinstance(content, bytes) else content
+  return {
+    'size': len(body),
+    'md5': hashlib.md5(body).hexdigest()
+  }
@@ -0,0 +1,179 @@
+import copy
+import json
+import string
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+class FilterModule(object):
+  ''' Reduces the size of a generated template without changing the stack it creates '''
+  def filters(self):
+    return {
+      'stack_optimize': stack_optimize
+    }
+
+SEPARATORS = (',',':')
+OPTIONAL_SECTIONS = ['Metadata', 'Parameters', 'Mappings', 'Conditions', 'Outputs']
+# CloudFormation limits templates to 200 mappings, and each mapping to 200 attributes
+MAPPINGS = 200
+MAPPING_ATTRIBUTES = 200
+MAPPING_PREFIX = 'Lit'
+MAPPING_KEY = 'V'
+KEY_CHARS = string.ascii_letters + string.digits
+
+def compact_length(value):
+  return len(json.dumps(value, separators=SEPARATORS))
+
+def is_function(node):
+  if not isinstance(node, dict) or len(node) != 1:
+    return False
+  function = list(node)[0]
+  return function in ['Ref', 'Condition'] or function.startswith('Fn::')
+
+def is_literal(value, lists=False):
+  return isinstance(value, basestring) or (
+    lists and isinstance(value, list) and len(value) > 0 and all(isinstance(v, basestring) for v in value)
+  )
+
+# Yields each value of a template node, e.g. Fn::If and Fn::Join arguments
+def walk(node):
+  yield node
+  children = node.values() if isinstance(node, dict) else node if isinstance(node, list) else []
+  for child in children:
+    for value in walk(child):
+      yield value
+
+# Returns the conditions used by resources and outputs, including conditions used by other used conditions
+def used_conditions(data):
+  def references(node):
+    names = set()
+    for value in walk(node):
+      if isinstance(value, dict):
+        if isinstance(value.get('Condition'), basestring):
+          names.add(value['Condition'])
+        if isinstance(value.get('Fn::If'), list) and value['Fn::If'] and isinstance(value['Fn::If'][0], basestring):
+          names.add(value['Fn::If'][0])
+    return names
+  conditions = data.get('Conditions') or {}
+  used = references(dict((k, v) for k, v in data.items() if k != 'Conditions'))
+  pending = list(used)
+  while pending:
+    for name in references(conditions.get(pending.pop())):
+      if name not in used:
+        used.add(name)
+        pending.append(name)
+  return used
+
+# Returns the mappings used by Fn::FindInMap, or None if a mapping name is not a literal
+def used_mappings(data):
+  used = set()
+  for value in walk(dict((k, v) for k, v in data.items() if k != 'Mappings')):
+    if isinstance(value, dict) and isinstance(value.get('Fn::FindInMap'), list) and value['Fn::FindInMap']:
+      name = value['Fn::FindInMap'][0]
+      if not isinstance(name, basestring):
+        return None
+      used.add(name)
+  return used
+
+# Yields (container, key) of each literal that can be replaced with Fn::FindInMap
+# Literals are property values, list items and the value arguments of Fn::If, Fn::Join, Fn::Select, Fn::Sub and Fn::Base64.
+# Literal arguments of other intrinsic functions (e.g. Ref, Fn::GetAtt and Fn::Join delimiters) are left as is
+def literal_sites(container, key, lists=True):
+  value = container[key]
+  if is_literal(value, lists):
+    yield container, key
+    return
+  if is_function(value):
+    function, args = list(value.items())[0]
+    positions = []
+    if function == 'Fn::If' and isinstance(args, list) and len(args) == 3:
+      positions = [(args, 1, True), (args, 2, True)]
+    elif function in ['Fn::Join', 'Fn::Select'] and isinstance(args, list) and len(args) == 2 and isinstance(args[1], list):
+      positions = [(args[1], i, False) for i in range(len(args[1]))]
+    elif function == 'Fn::Sub' and isinstance(args, list) and len(args) == 2 and isinstance(args[1], dict):
+      positions = [(args[1], k, False) for k in args[1]]
+    elif function == 'Fn::Base64':
+      positions = [(value, function, False)]
+    for c, k, l in positions:
+      for site in literal_sites(c, k, l):
+        yield site
+    return
+  if isinstance(value, dict):
+    for k in value:
+      for site in literal_sites(value, k, True):
+        yield site
+  elif isinstance(value, list):
+    for i in range(len(value)):
+      for site in literal_sites(value, i, False):
+        yield site
+
+# Yields (container, key) of each literal in resource properties and output values
+def template_literal_sites(data):
+  for resource in (data.get('Resources') or {}).values():
+    if isinstance(resource, dict) and isinstance(resource.get('Properties'), dict) and not str(resource.get('Type')).startswith('AWS::Serverless::'):
+      for site in literal_sites(resource, 'Properties'):
+        yield site
+  for output in (data.get('Outputs') or {}).values():
+    if isinstance(output, dict) and 'Value' in output:
+      for site in literal_sites(output, 'Value', False):
+        yield site
+
+def mapping_key(index):
+  key = ''
+  while True:
+    key = KEY_CHARS[index % len(KEY_CHARS)] + key
+    index = index // len(KEY_CHARS)
+    if not index:
+      return key
+
+# Replaces repeated literals with Fn::FindInMap references to new mappings, where this reduces the template size
+def hoist_literals(data):
+  sites = {}
+  for container, key in template_literal_sites(data):
+    sites.setdefault(json.dumps(container[key], sort_keys=True), []).append((container, key))
+  mappings = data.get('Mappings') or {}
+  names = (MAPPING_PREFIX + str(i) for i in range(len(mappings) + MAPPINGS) if MAPPING_PREFIX + str(i) not in mappings)
+  reference_length = compact_length({'Fn::FindInMap': [MAPPING_PREFIX + '0', MAPPING_KEY, 'aa']})
+  savings = []
+  for literal, occurrences in sites.items():
+    length = compact_length(json.loads(literal))
+    # Each occurrence is replaced by a reference, and the literal is added once as a mapping attribute
+    saving = len(occurrences) * (length - reference_length) - length - len('"aa":,')
+    if len(occurrences) > 1 and saving > 0:
+      savings.append((-saving, literal))
+  hoisted = [literal for saving, literal in sorted(savings)][:max(MAPPINGS - len(mappings), 0) * MAPPING_ATTRIBUTES]
+  if not hoisted:
+    return data
+  for index, literal in enumerate(hoisted):
+    if index % MAPPING_ATTRIBUTES == 0:
+      name = next(names)
+      mappings[name] = {MAPPING_KEY: {}}
+    key = mapping_key(index % MAPPING_ATTRIBUTES)
+    mappings[name][MAPPING_KEY][key] = json.loads(literal)
+    for container, site in sites[literal]:
+      container[site] = {'Fn::FindInMap': [name, MAPPING_KEY, key]}
+  data['Mappings'] = mappings
+  return data
+
+# Returns an equivalent template that is smaller when serialized as compact JSON, by removing unused conditions,
+# unused mappings and empty sections, and optionally hoisting repeated literals into mappings
+# Literals are not hoisted in templates with a Transform, as macros may not support Fn::FindInMap
+def stack_optimize(data, hoist=True):
+  data = copy.deepcopy(data)
+  if data.get('Conditions'):
+    used = used_conditions(data)
+    data['Conditions'] = dict((k, v) for k, v in data['Conditions'].items() if k in used)
+  if data.get('Mappings'):
+    used = used_mappings(data)
+    if used is not None:
+      data['Mappings'] = dict((k, v) for k, v in data['Mappings'].items() if k in used)
+  for section in OPTIONAL_SECTIONS:
+    if section in data and not data[section]:
+      del data[section]
+  if hoist and 'Transform' not in data:
+    optimized = hoist_literals(copy.deepcopy(data))
+    if compact_length(optimized) < compact_length(data):
+      data = optimized
+  return data
@@ -26,70 +26,95 @@ def assign(parent, data, index):
 def append(parent, data, index):
   parent += data
 
-def stack_overrides(vars, source='Stack', paths=[
+SELECTOR = re.compile(r'[\[\]\*]+')
+KEY_FILTER = re.compile(r'(.*)\[(.*)\]$')
+PLANS = {}
+
+# Compiles override selectors into an ordered plan of operations
+# Each step is a tuple in form (selector, operation, compiled expression, key, index)
+# Steps are ordered by section path and then selector depth, plans are cached by selector set
+def override_plan(selectors, source='Stack', paths=[
   'Description','Metadata','Parameters', 'Resources', 'Mappings', 'Outputs', 'Conditions'
 ]):
-  # Selects top level source object - e.g. 'Stack'
-  data = vars[source]
-  # Sort keys based upon selector depth
-  vars_keys = list(vars.keys())
-  vars_keys.sort(key=lambda k: len(k.split(".")))  # TODO: what if filters have '.' characters?
-  # Assuming [{'Stack.x.x.x': 'value'}...]
-  # Returns tuples in form [('Stack.x.x.x', 'value')...]
-  params = [(k,vars[k]) for p in paths for k in vars_keys if k.startswith(source + '.' + p)]
-  for param in params:
-    # Ignore params with only dotted syntax, they are processed by dotted dict
-    if not re.search('[\[\]\*]+',param[0]):
-      continue
-    parts = param[0].split(".",1)
-    if len(parts) == 1:
-      data = param[1]
-      continue
-    parts = parts[1].rsplit(".",1)
+  cache_key = (source, tuple(paths), tuple(selectors))
+  if cache_key in PLANS:
+    return PLANS[cache_key]
+  prefixes = [source + '.' + p for p in paths]
+  # Sort selectors based upon path order and then selector depth
+  ordered = sorted(
+    ((i, len(k.split(".")), k) for k in selectors for i,prefix in enumerate(prefixes) if k.startswith(prefix)),
+    key=lambda s: s[:2]
+  )  # TODO: what if filters have '.' characters?
+  plan = []
+  for (_, _, selector) in ordered:
+    parts = selector.split(".",1)[1].rsplit(".",1)
     if len(parts) == 1:
-      data[parts[0]] = param[1]
+      plan.append((selector, 'set', None, parts[0], None))
       continue
     path = parts[0]
     key = parts[1]
-    key_parts = re.match('(.*)\[(.*)\]$',key)
+    key_parts = KEY_FILTER.match(key)
     if key_parts:
       key_prop = key_parts.groups()[0]
       key_filter = key_parts.groups()[1]
       if key_filter and key_filter.isdigit():
-        # Example: Stack.Resources.MyResource.Values[0]: <new value>
-        # Here we need to select path + key_prop and then use key_filter as index
-        parent = jmespath.search(path + '.' + key_prop, data)
-        if parent is None:
-          continue
-        if type(parent) is list:
-          flatten(assign, parent, param[1], int(key_filter))
-        else:
-          parent[int(key_filter)] = param[1]
+        plan.append((selector, 'index', jmespath.compile(path + '.' + key_prop), None, int(key_filter)))
       elif not key_filter:
-        # Example: Stack.Resources.MyResource.Values[]: <new value>
-        # Here we need to add value to path + key_prop
-        parent = jmespath.search(path + '.' + key_prop, data)
-        if parent is None:
-          continue
-        flatten(append, parent, param[1])
+        plan.append((selector, 'append', jmespath.compile(path + '.' + key_prop), None, None))
       else:
-        # Example: Stack.Resources.MyResource.Values[?prop='value']: <new value>
-        # Here we assume <new value> is a dict and we need to replace dict keys/values with <new value? keys/values
-        parent = jmespath.search(path + '.' + key, data)
-        if parent is None:
-          continue
-        for p in parent:
-          for k in list(p):
-            del p[k]
-          for k,v in param[1].items():
-            p[k] = v
+        plan.append((selector, 'filter', jmespath.compile(path + '.' + key), None, None))
     else:
-      parent = jmespath.search(path, data)
-      if parent is None:
-        continue
+      plan.append((selector, 'assign', jmespath.compile(path), key, None))
+  PLANS[cache_key] = plan
+  return plan
+
+# Applies a compiled override plan to source data using selector values from vars
+def apply_override_plan(plan, data, vars):
+  for (selector, op, expression, key, index) in plan:
+    value = vars[selector]
+    if op == 'set':
+      data[key] = value
+      continue
+    parent = expression.search(data)
+    if parent is None:
+      continue
+    if op == 'index':
+      # Example: Stack.Resources.MyResource.Values[0]: <new value>
+      # Here we need to select path + key_prop and then use key_filter as index
       if type(parent) is list:
-        for p in parent:
-          p[key] = param[1]
+        flatten(assign, parent, value, index)
       else:
-        parent[key] = param[1]  
+        parent[index] = value
+    elif op == 'append':
+      # Example: Stack.Resources.MyResource.Values[]: <new value>
+      # Here we need to add value to path + key_prop
+      flatten(append, parent, value)
+    elif op == 'filter':
+      # Example: Stack.Resources.MyResource.Values[?prop='value']: <new value>
+      # Here we assume <new value> is a dict and we need to replace dict keys/values with <new value? keys/values
+      for p in parent:
+        for k in list(p):
+          del p[k]
+        for k,v in value.items():
+          p[k] = v
+    elif type(parent) is list:
+      for p in parent:
+        p[key] = value
+    else:
+      parent[key] = value
   return data
+
+# Returns complex override selectors and their values - e.g. {'Stack.x.x[0]': 'value'}
+# Ignore params with only dotted syntax, they are processed by dotted dict
+def stack_selectors(vars, source='Stack'):
+  prefix = source + '.'
+  return dict((k,vars[k]) for k in vars if k.startswith(prefix) and SELECTOR.search(k))
+
+def stack_overrides(vars, source='Stack', paths=[
+  'Description','Metadata','Parameters', 'Resources', 'Mappings', 'Outputs', 'Conditions'
+]):
+  # Selects top level source object - e.g. 'Stack'
+  data = vars[source]
+  # Assuming [{'Stack.x.x.x': 'value'}...]
+  selectors = stack_selectors(vars, source)
+  return apply_override_plan(override_plan(list(selectors), source, paths), data, selectors)
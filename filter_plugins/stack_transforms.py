@@ -1,14 +1,45 @@
-from jinja2 import Template,FileSystemLoader,Environment,TemplateNotFound
+from jinja2 import Template,FileSystemLoader,FileSystemBytecodeCache,Environment,TemplateNotFound
+from jinja2.defaults import DEFAULT_FILTERS
 from ansible.plugins.loader import filter_loader
 from ansible.errors import AnsibleError
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import reduce
+import datetime
 import yaml
+import json
 import os
 import re
 import logging
+import time
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+try:
+  text_type = unicode
+except NameError:
+  text_type = str
+
+# Use the libyaml C loader and dumper when available
+try:
+  from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+  from yaml import SafeLoader, SafeDumper
 
 FORMAT = "[stack_transform]: %(message)s"
 PROPERTY_TRANSFORM = 'Property::Transform'
 STACK_TRANSFORM = 'Stack::Transform'
+INTRINSIC_HEADS = ['Fn::FindInMap','Fn::GetAtt','Fn::If']
+SUB_TOKEN = r'(?=\${([^}]*))'
+
+# Jinja environments shared by all templates rendered in this process, keyed by template paths and cache path
+ENVIRONMENTS = {}
+
+# Ansible filter registries shared by all transforms in this process, keyed by filter paths
+FILTERS = {}
 
 class FilterModule(object):
   ''' Executes custom property transforms defined in a CloudFormation stack '''
@@ -16,9 +47,91 @@ class FilterModule(object):
     return {
         'property_transform': property_transform,
         'stack_transform': stack_transform,
-        'stack_output': stack_output
+        'stack_output': stack_output,
+        'stack_merge': stack_merge,
+        'to_stack_yaml': to_stack_yaml
     }
 
+class StackDumper(SafeDumper):
+  ''' Safe YAML dumper that also represents subclasses of builtin types, such as Ansible unsafe text and tagged values '''
+
+# Text subclasses are converted to plain text, as the libyaml emitter only accepts builtin strings
+StackDumper.add_multi_representer(
+  text_type, lambda dumper, data: getattr(SafeDumper, 'represent_unicode', SafeDumper.represent_str)(dumper, text_type(data))
+)
+StackDumper.add_multi_representer(bool, SafeDumper.represent_bool)
+StackDumper.add_multi_representer(int, SafeDumper.represent_int)
+StackDumper.add_multi_representer(float, SafeDumper.represent_float)
+StackDumper.add_multi_representer(datetime.date, SafeDumper.represent_date)
+StackDumper.add_multi_representer(datetime.datetime, SafeDumper.represent_datetime)
+StackDumper.add_multi_representer(dict, SafeDumper.represent_dict)
+StackDumper.add_multi_representer(list, SafeDumper.represent_list)
+
+# Returns the (name, filter) pairs of a filter plugin
+# Ansible 2.14 and later load a plugin per filter, earlier releases load filter modules that return all of their filters
+def plugin_filters(plugin):
+  if hasattr(plugin, 'filters'):
+    return plugin.filters().items()
+  names = set([plugin.ansible_name] + list(getattr(plugin, 'ansible_aliases', None) or []))
+  names.update(name.split('.')[-1] for name in list(names) if name.startswith(('ansible.builtin.', 'ansible.legacy.')))
+  return [(name, plugin.j2_function) for name in names]
+
+class AnsibleFilters(dict):
+  ''' Jinja builtin and Ansible filters, loading filter plugins once when a filter is first resolved '''
+  def __init__(self, plugins):
+    dict.__init__(self, DEFAULT_FILTERS)
+    self.plugins = plugins
+
+  # Filter plugins override Jinja builtin filters of the same name, and the last plugin that defines a filter wins,
+  # as per combining the filters of all plugins in load order.  Ansible 2.19 and later replace the default filter
+  # with a filter that only accepts undefined markers of the Ansible template engine, so builtin filters are kept
+  # in place of these filters
+  def load(self):
+    if self.plugins is not None:
+      for plugin in self.plugins:
+        self.update(
+          (name, value) for name, value in plugin_filters(plugin)
+          if not (name in DEFAULT_FILTERS and getattr(value, 'accept_args_markers', False))
+        )
+      self.plugins = None
+    return self
+
+  def __getitem__(self, name):
+    return dict.__getitem__(self.load(), name)
+
+  def __contains__(self, name):
+    return dict.__contains__(self.load(), name)
+
+  def get(self, name, default=None):
+    return dict.get(self.load(), name, default)
+
+# Recursively merges source into target in place, as per combine(recursive=True)
+# Dictionaries are merged, all other values (including lists) are replaced and merged values are not copied
+def merge_into(target, source):
+  for key, value in source.items():
+    if isinstance(target.get(key), dict) and isinstance(value, dict):
+      merge_into(target[key], value)
+    else:
+      target[key] = value
+  return target
+
+# Recursively merges dictionaries, as per combine(recursive=True)
+# Only dictionaries on merged paths are copied, all other values are shared with the merged dictionaries
+def stack_merge(*terms):
+  def merge(a, b):
+    result = dict(a)
+    for key, value in b.items():
+      if isinstance(result.get(key), dict) and isinstance(value, dict):
+        result[key] = merge(result[key], value)
+      else:
+        result[key] = value
+    return result
+  return reduce(merge, terms, {})
+
+# Dumps data as YAML, as per to_nice_yaml
+def to_stack_yaml(data, indent=4, **kwargs):
+  return yaml.dump(data, Dumper=StackDumper, indent=indent, allow_unicode=True, default_flow_style=False, **kwargs)
+
 def stack_output(data):
   return { 
     k: data[k] 
@@ -47,27 +160,49 @@ def lookup_template(file, template_paths=os.getcwd()):
     raise AnsibleError("Could not locate template %s in paths %s" % (file,template_paths))
   return template_file
 
-def render_template(template_file, template_paths, data, filters={}, **kwargs):
-  # Create Jinja environment
-  environment = Environment()
-  environment.loader = FileSystemLoader(template_paths)
-  if filters:
-    environment.filters = dict(environment.filters.items() + filters.items())
+# Returns a persistent Jinja environment for the template paths.  Compiled templates are cached
+# in memory by the environment (and reloaded when a template file is modified), and on disk by
+# the bytecode cache keyed by template path and source checksum, so subsequent runs skip compilation.
+def template_environment(template_paths, filters={}, cache_path=None):
+  key = (tuple(template_paths) if isinstance(template_paths, list) else (template_paths,), cache_path)
+  environment = ENVIRONMENTS.get(key)
+  if not environment:
+    try:
+      bytecode_cache = FileSystemBytecodeCache(cache_path)
+    except Exception as e:
+      logging.debug("Template bytecode cache is disabled: %s", e)
+      bytecode_cache = None
+    environment = ENVIRONMENTS[key] = Environment(
+      loader=FileSystemLoader(template_paths),
+      bytecode_cache=bytecode_cache
+    )
+  if isinstance(filters, AnsibleFilters):
+    environment.filters = filters
+  elif filters:
+    environment.filters.update(filters)
+  return environment
+
+def render_template(template_file, template_paths, data, filters={}, cache_path=None, **kwargs):
+  # Get Jinja environment
+  environment = template_environment(template_paths, filters, cache_path)
   # Render template, passing data in as Config dictionary
   try:
     template = environment.get_template(template_file)
     rendered = template.render({'Config': data})
-    return yaml.load(rendered)
+    return yaml.load(rendered, Loader=SafeLoader)
   except TemplateNotFound as e:
     raise AnsibleError("Could not locate template %s in the supplied template paths %s" % (template_file,template_paths))
   except Exception as e:
     raise AnsibleError("An error occurred: %s" % e)
 
 def ansible_filters(filter_paths):
-  # Load Ansible filters  
-  for path in filter_paths:
-    filter_loader.add_directory(path)
-  return { k:v for filter in filter_loader.all() for k,v in filter.filters().items() }
+  # Load Ansible filters when first used, once per set of filter paths
+  key = tuple(filter_paths)
+  if key not in FILTERS:
+    for path in filter_paths:
+      filter_loader.add_directory(path)
+    FILTERS[key] = AnsibleFilters(filter_loader.all())
+  return FILTERS[key]
 
 # Joins a list of items with a delimiter object
 # e.g. [{'Ref':'AWS::StackName'},'-Thing'] => [{'Ref':'AWS::StackName'},{'Fn::ImportValue':'xyz'},'-Thing']
@@ -76,76 +211,226 @@ def list_join(items, delimiter):
 
 # Splits an Fn::Sub expression and returns list with parameter expressions replaced with Refs
 # e.g. '${AWS::StackName}-Thing' => [{'Ref':'AWS::StackName'},'-Thing']
-def ref_replace(s, regex='\${([^{}]*)}'):
+def ref_replace(s, regex=r'\${([^{}]*)}'):
   parts = re.split(regex,s)
   return [ {'Ref': parts[n] } if n % 2 else parts[n] for n in range(len(parts)) if parts[n] ]
 
-# Walks stack data structure and searchs and replaces a given parameter
-def search_and_replace(data, search, replace, as_value=False):
-  # Fn::Sub is evil!
-  def parse_fn_sub_instrinsic_functions(item, node, parent, parent_key):
-    ascii_node = {str(k): str(v) for k, v in node.items()}
-    parts = ascii_node['Fn::Sub'].split('${%s}' % search)
-    joined_parts = list_join(parts, replace)
-    ref_replaced = reduce(
-      lambda acc,item: acc + ref_replace(item) 
-      if type(item) is str else acc + [item], joined_parts, [])
-    parent[parent_key] = { 'Fn::Join': ['', ref_replaced ] }
-  def parse(key, item, node, parent, parent_key):
-    if node == search:
+# Fn::Sub is evil!
+# Replaces an Fn::Sub node with an equivalent Fn::Join that embeds the intrinsic function replace value
+def parse_fn_sub_instrinsic_functions(node, parent, parent_key, search, replace):
+  ascii_node = {str(k): str(v) for k, v in node.items()}
+  parts = ascii_node['Fn::Sub'].split('${%s}' % search)
+  joined_parts = list_join(parts, replace)
+  ref_replaced = reduce(
+    lambda acc,item: acc + ref_replace(item) 
+    if type(item) is str else acc + [item], joined_parts, [])
+  parent[parent_key] = { 'Fn::Join': ['', ref_replaced ] }
+
+# Searches and replaces a given parameter in the value of a single node key
+def replace_reference(key, item, node, parent, parent_key, search, replace, as_value=False):
+  if node == search:
+    parent[parent_key] = replace
+  elif key == 'Ref' and item == search:
+    if as_value:
       parent[parent_key] = replace
-    elif key == 'Ref' and item == search:
-      if as_value:
-        parent[parent_key] = replace
-      else:
-        node[key] = replace
-    elif key in ['Fn::FindInMap','Fn::GetAtt','Fn::If'] and item[0] == search:
-      node[key][0] = replace
-    elif key == 'Condition' and search == item and parent_key != 'Properties' and isinstance(replace, (basestring,int)):
+    else:
       node[key] = replace
-    elif key == 'DependsOn' and search in item and parent_key != 'Properties' and isinstance(replace, (basestring,int)):
-      node[key][item.index(search)] = replace
-    elif key == 'DependsOn' and search in item and parent_key != 'Properties' and isinstance(replace, list):
-      del node[key][item.index(search)]
-      node[key] += replace
-    elif key == 'Fn::Sub' and '${%s' % search in item:
-      replace_value = str(replace)
-      if as_value:
-        if type(replace) is dict and 'Ref' in replace.keys():
-          replace_value = '${%s}' % replace['Ref']
-          node[key] = item.replace('${%s}' % search, replace_value)
-        elif type(replace) is dict and 'Fn::Sub' in replace.keys():
-          replace_value = replace['Fn::Sub']
-          node[key] = item.replace('${%s}' % search, replace_value)
-        elif type(replace) is dict and 'Fn::GetAtt' in replace.keys():
-          replace_value = '${%s}' % ('.').join(replace['Fn::GetAtt'])
-          node[key] = item.replace('${%s}' % search, replace_value)
-        elif type(replace) is dict and 'Fn::GetAtt' in replace.keys():
-          replace_value = '${%s}' % ('.').join(replace['Fn::GetAtt'])
-          node[key] = item.replace('${%s}' % search, replace_value)
-        elif type(replace) is dict and list(set(['Fn::ImportValue','Fn::If','Fn::Join','Fn::Select']) & set(replace.keys())):
-          parse_fn_sub_instrinsic_functions(item, node, parent, parent_key)
-        else:
-          node[key] = item.replace('${%s}' % search, replace_value)
+  elif key in INTRINSIC_HEADS and item[0] == search:
+    node[key][0] = replace
+  elif key == 'Condition' and search == item and parent_key != 'Properties' and isinstance(replace, (basestring,int)):
+    node[key] = replace
+  elif key == 'DependsOn' and search in item and parent_key != 'Properties' and isinstance(replace, (basestring,int)):
+    node[key][item.index(search)] = replace
+  elif key == 'DependsOn' and search in item and parent_key != 'Properties' and isinstance(replace, list):
+    del node[key][item.index(search)]
+    node[key] += replace
+  elif key == 'Fn::Sub' and '${%s' % search in item:
+    replace_value = str(replace)
+    if as_value:
+      if isinstance(replace, dict) and 'Ref' in replace.keys():
+        replace_value = '${%s}' % replace['Ref']
+        node[key] = item.replace('${%s}' % search, replace_value)
+      elif isinstance(replace, dict) and 'Fn::Sub' in replace.keys():
+        replace_value = replace['Fn::Sub']
+        node[key] = item.replace('${%s}' % search, replace_value)
+      elif isinstance(replace, dict) and 'Fn::GetAtt' in replace.keys():
+        replace_value = '${%s}' % ('.').join(replace['Fn::GetAtt'])
+        node[key] = item.replace('${%s}' % search, replace_value)
+      elif isinstance(replace, dict) and list(set(['Fn::ImportValue','Fn::If','Fn::Join','Fn::Select']) & set(replace.keys())):
+        parse_fn_sub_instrinsic_functions(node, parent, parent_key, search, replace)
       else:
-        node[key] = item.replace('${%s' % search, '${%s' % replace_value)
+        node[key] = item.replace('${%s}' % search, replace_value)
+    else:
+      node[key] = item.replace('${%s' % search, '${%s' % replace_value)
+
+# Walks stack data structure and searchs and replaces a given parameter
+def search_and_replace(data, search, replace, as_value=False, stats=None):
   def walk(node, parent=[None], parent_key=0):
-    if type(node) is list:
+    if stats is not None:
+      stats['nodes'] += 1
+    if isinstance(node, list):
       for index, item in enumerate(node):
         walk(item, node, index)
-    elif type(node) is dict:
+    elif isinstance(node, dict):
       for key, item in node.items():
-        parse(key, item, node, parent, parent_key)
+        replace_reference(key, item, node, parent, parent_key, search, replace, as_value)
         walk(item, node, key)
+  if stats is not None:
+    stats['walks'] += 1
   walk(data)
 
+# Reference index for one or more stack data structures, built in a single walk of each structure.
+# Symbols (Ref targets, intrinsic function heads, Condition and DependsOn entries) and Fn::Sub
+# ${...} tokens map to the (node, key) locations holding them, and each indexed container maps
+# to the frames ([parent frame, key]) it is reachable from, so that references can be replaced
+# in place with the same results as search_and_replace without walking the entire structure.
+# Counts of searches, full walks, nodes visited and indexed locations visited are accumulated in stats.
+def reference_index(stats=None):
+  return {
+    'roots': {},
+    'symbols': defaultdict(list),
+    'tokens': defaultdict(list),
+    'frames': defaultdict(list),
+    'stats': stats if stats is not None else report_counts()
+  }
+
+def index_symbol(bucket, symbol, location):
+  try:
+    bucket[symbol].append(location)
+  except TypeError:
+    pass
+
+def index_reference(index, node, key, item):
+  if key in ['Ref','Condition']:
+    index_symbol(index['symbols'], item, (node, key))
+  elif key in INTRINSIC_HEADS and isinstance(item, (list, basestring)) and item:
+    index_symbol(index['symbols'], item[0], (node, key))
+  elif key == 'DependsOn' and isinstance(item, list):
+    for dependency in item:
+      index_symbol(index['symbols'], dependency, (node, key))
+  elif key == 'DependsOn' and isinstance(item, basestring):
+    index_symbol(index['symbols'], item, (node, key))
+  elif key == 'Fn::Sub' and isinstance(item, basestring):
+    for token in re.findall(SUB_TOKEN, item):
+      index_symbol(index['tokens'], token, (node, key))
+
+def index_node(index, node, frame):
+  index['stats']['nodes'] += 1
+  if isinstance(node, list):
+    index['frames'][id(node)].append(frame)
+    for key, item in enumerate(node):
+      index_node(index, item, [frame, key])
+  elif isinstance(node, dict):
+    indexed = id(node) in index['frames']
+    index['frames'][id(node)].append(frame)
+    for key, item in node.items():
+      if not indexed:
+        index_reference(index, node, key, item)
+      index_node(index, item, [frame, key])
+
+# Adds a stack data structure to the index under the given root name
+def index_root(index, root, data):
+  index['roots'][root] = data
+  index_node(index, data, [None, root])
+
+# Resolves a frame to its (root, parent, node), where parent is None for a root or an unreachable frame
+def resolve_frame(index, frame):
+  keys = []
+  while frame[0] is not None:
+    keys.append(frame[1])
+    frame = frame[0]
+  parent, node = [None], index['roots'].get(frame[1])
+  try:
+    for key in reversed(keys):
+      parent, node = node, node[key]
+  except (KeyError, IndexError, TypeError):
+    return frame[1], None, None
+  return frame[1], parent, node
+
+# Renames a key in an indexed dictionary, updating the frames of the renamed item
+def rename_key(index, parent, key, new_key):
+  item = parent[new_key] = parent.pop(key)
+  for frame in index['frames'].get(id(item), []):
+    if frame[1] == key and resolve_frame(index, frame[0])[2] is parent:
+      frame[1] = new_key
+
+# Moves the frames of an indexed dictionary section to another root, e.g. after merging the section into it
+def move_section(index, data, section, root):
+  for frame in index['frames'].get(id(data.get(section)), []):
+    if frame[0][0] is None:
+      frame[0] = [None, root]
+
+# Returns the indexed locations that may hold a search parameter, or None if the parameter cannot be looked up
+def index_locations(index, search):
+  symbol = search
+  if isinstance(search, dict) and len(search) == 1:
+    key, item = list(search.items())[0]
+    if key == 'Ref':
+      symbol = item
+    elif key in INTRINSIC_HEADS and isinstance(item, (list, basestring)) and item:
+      symbol = item[0]
+  if isinstance(symbol, (dict, list)):
+    return None
+  try:
+    locations = list(index['symbols'].get(symbol, []))
+  except TypeError:
+    return None
+  if isinstance(search, (basestring,int)):
+    prefix = '%s' % search
+    locations += [
+      location
+      for token, token_locations in list(index['tokens'].items())
+      if token.startswith(prefix) or '}' in prefix
+      for location in token_locations
+    ]
+  return locations
+
+# Searches and replaces a given parameter in an indexed stack data structure, visiting only
+# the indexed locations of the parameter in each of their reachable frames under the given root
+def index_search_and_replace(index, root, search, replace, as_value=False):
+  index['stats']['searches'] += 1
+  locations = index_locations(index, search)
+  if locations is None:
+    search_and_replace(index['roots'][root], search, replace, as_value, index['stats'])
+    index_root(index, root, index['roots'][root])
+    return
+  visited = set()
+  for node, key in locations:
+    for frame in list(index['frames'][id(node)]):
+      index['stats']['locations'] += 1
+      frame_root, parent, current = resolve_frame(index, frame)
+      parent_key = frame[1] if frame[0] is not None else 0
+      if frame_root != root or current is not node or key not in node:
+        continue
+      if (id(parent), parent_key, id(node), key) in visited:
+        continue
+      visited.add((id(parent), parent_key, id(node), key))
+      item = node[key]
+      previous = list(item) if isinstance(item, list) else item
+      replace_reference(key, item, node, parent, parent_key, search, replace, as_value)
+      if parent[parent_key] is not node:
+        if frame[0] is not None:
+          index_node(index, parent[parent_key], frame)
+      elif node[key] != previous:
+        index_reference(index, node, key, node[key])
+        if node[key] is item:
+          parent_frames, children = index['frames'][id(item)], [
+            (child_key, child) for child_key, child in enumerate(item)
+            if not any(child is p for p in previous)
+          ]
+        else:
+          parent_frames, children = index['frames'][id(node)], [(key, node[key])]
+        for parent_frame in list(parent_frames):
+          for child_key, child in children:
+            index_node(index, child, [parent_frame, child_key])
+
 def find_in_sub(search, values):
   if search:
     return [v for v in values if search.find('${%s' % v) >= 0]
   else:
     return []
 
-def fix_conditions(data, transform, input_parameter_key, input_parameter_value, resource_property):
+def fix_conditions(data, transform, input_parameter_key, input_parameter_value, resource_property, stats=None):
   resource_keys = data['Resources'].keys()
   if (isinstance(resource_property, dict) and
       (resource_property.get('Ref') in resource_keys or
@@ -155,9 +440,32 @@ def fix_conditions(data, transform, input_parameter_key, input_parameter_value,
     # Find and replace any conditions that reference an illegal input parameter
     for c,v in transform.get('Conditions',{}).items():
       logging.debug("--> Forcing evaluation of condition %s as it references an illegal input value", c)
-      search_and_replace(transform['Conditions'],{'Ref':input_parameter_key}, input_parameter_key)
+      search_and_replace(transform['Conditions'],{'Ref':input_parameter_key}, input_parameter_key, stats=stats)
+
+def report_counts():
+  return {'searches': 0, 'walks': 0, 'nodes': 0, 'locations': 0}
 
-def stack_transform(data, filter_paths=[],template_paths=[], debug=False):
+# Returns an empty stack transform report, which records the elapsed time and counts of each stage,
+# and of each transform within each stage
+def transform_report():
+  return {'time': 0.0, 'stages': {}, 'transforms': {}, 'counts': report_counts()}
+
+# Records the elapsed time and counts of a block in a report stage, or a transform within a report stage
+@contextmanager
+def report_timer(report, stage, name=None):
+  start, counts = time.time(), dict(report['counts'])
+  try:
+    yield
+  finally:
+    if name is None:
+      entry = report['stages'].setdefault(stage, {'time': 0.0})
+    else:
+      entry = report['transforms'].setdefault(name, {}).setdefault(stage, {'time': 0.0})
+    entry['time'] += time.time() - start
+    for key, count in report['counts'].items():
+      entry[key] = entry.get(key, 0) + count - counts[key]
+
+def stack_transform(data, filter_paths=[],template_paths=[], debug=False, cache_path=None, report=None, report_path=None):
   # Set logging level
   if debug:
     logging.basicConfig(level=logging.DEBUG, format=FORMAT)
@@ -166,116 +474,169 @@ def stack_transform(data, filter_paths=[],template_paths=[], debug=False):
   filter_paths = [os.getcwd() + '/filter_plugins'] + filter_paths
   template_paths = [os.getcwd() + '/templates'] + template_paths
   
+  # Record stage and transform timings in the supplied report dictionary
+  start = time.time()
+  if report is None:
+    report = {}
+  report.update(transform_report())
+
   # Load Ansible filters  
   filters = ansible_filters(filter_paths)
-  combine = filters['combine']
+
+  # Copy the stack and sections that transforms are merged into, so that transforms can be merged in place
+  data = dict(data)
+  for section in ['Resources','Mappings','Conditions']:
+    if section in data:
+      data[section] = dict(data[section])
 
   # Get resource transforms - {Stack}.Resources.<Resource> where <Resource>.Type = Stack::Transform::<transform>
-  transforms = [
-    {
-      'name': resource_key,
-      'resource': resource_value,
-      'output': render_template(os.path.basename(file), os.path.dirname(file), resource_value, filters) 
-    }
-    for resource_key, resource_value in data['Resources'].items()
-    if resource_value.get('Type') == STACK_TRANSFORM
-    for file in [lookup_template(resource_value['Template'], template_paths)]
-  ]
+  transforms = []
+  with report_timer(report, 'render'):
+    for resource_key, resource_value in data['Resources'].items():
+      if resource_value.get('Type') != STACK_TRANSFORM:
+        continue
+      with report_timer(report, 'render', resource_key):
+        file = lookup_template(resource_value['Template'], template_paths)
+        transforms.append({
+          'name': resource_key,
+          'resource': resource_value,
+          'output': render_template(os.path.basename(file), os.path.dirname(file), resource_value, filters, cache_path)
+        })
+      report['transforms'][resource_key]['template'] = resource_value['Template']
+
+  # Index references in main stack and transform outputs
+  with report_timer(report, 'index'):
+    index = reference_index(report['counts'])
+    index_root(index, None, data)
+    for transform in transforms:
+      with report_timer(report, 'index', transform['name']):
+        index_root(index, transform['name'], transform['output'])
 
   # Scan input parameters for each transform, calculate renamed parameter,
   # and rename any references to transform outputs in main stack.
   logging.debug("STAGE 1: RENAME MAIN STACK REFERENCES TO TRANSFORM OUTPUTS")
-  for transform in transforms:
-    name = transform['name']
-    transform_parameters = transform['output'].get('Parameters', {})
-    logging.debug("%s: Renaming input references in main stack", name)
-    for key in transform['output'].get('Outputs', {}).keys():
-      logging.debug("--> Renaming %s.%s to %s", name, key, name+key)
-      search_and_replace(data,'%s.%s' % (name, key), name+key)
-      logging.debug("--> Replacing {'Fn::GetAtt': ['%s','%s']} with %s", name, key, {'Ref': name+key})
-      search_and_replace(data, {'Fn::GetAtt': [name,key]}, {'Ref': name+key})
+  with report_timer(report, 'stage1'):
+    for transform in transforms:
+      with report_timer(report, 'stage1', transform['name']):
+        rename_output_references(index, transform)
 
   # Process each transform template, renaming template resources,
   # and merging template resources into main stack.
   logging.debug("STAGE 2: PROCESS TRANSFORM AND MERGE INTO MAIN STACK")
-  for transform in transforms:
-    name = transform['name']
-    resource = transform['resource']
-    resource_properties = resource['Properties']
-    output = transform['output']
-    output_parameters = output.get('Parameters', {})
-
-    # Rename keys in Resources, Mappings, Conditions and Outputs
-    logging.debug("%s: Renaming transform references", name)
-    for section in ['Resources','Mappings','Conditions','Outputs']:
-      for key in output.get(section, {}).keys():
-        # Check if renamed resources will clash with main stack
-        if section != 'Outputs' and name+key in data.get(section, {}).keys():
-          raise AnsibleError("ERROR: The key %s in transform %s clashes with object %s in main stack '%s'" % (key, name, name+key, section))
-        output[section][name+key] = output[section].pop(key)
-        logging.debug("--> Renaming %s to %s", key, name+key)
-        search_and_replace(output, key, name+key)
-
-    # Fix conditions that will result in illegally referencing a resource
-    logging.debug("%s: Evaluating conditions that reference a resource or stack export", name)
-    for output_param_key, output_param_value in output_parameters.items():
-      resource_property = resource_properties.get(output_param_key)
-      if resource_property:
-        fix_conditions(data, output, output_param_key, output_param_value, resource_property)
-
-    # Process input parameters
-    logging.debug("%s: Replacing transform input parameter values", name)
-    for output_param_key, output_param_value in output_parameters.items():
-      # Get corresponding transform input property from main stack
-      resource_property = resource_properties.get(output_param_key)
-      if resource_property:
-        # Replace input parameter values with the transform input property value
-        logging.debug("--> Replacing %s value with %s", output_param_key, resource_property)
-        search_and_replace(output, output_param_key, resource_property, as_value=True)
-      else:
-        # Replace input parameter values with input parameter default or raise error
-        default_value = output_param_value.get('Default')
-        if default_value is None:
-          raise AnsibleError("Transform parameter %s is missing associated transform property and default value" % output_param_key)
-        logging.debug("--> Replacing %s value with %s", output_param_key, default_value)
-        search_and_replace(output, output_param_key, default_value, as_value=True)
-  
+  with report_timer(report, 'stage2'):
+    for transform in transforms:
+      with report_timer(report, 'stage2', transform['name']):
+        process_transform(index, data, transform)
+
   # Replace references to merged transform outputs with transformed output values
   logging.debug("STAGE 3: REPLACE TRANSFORMED OUTPUT VALUES IN MAIN STACK")
-  for transform in transforms:
-    name = transform['name']
-    output = transform['output']
-    dependency_mapping = output.get('Metadata',{}).get(STACK_TRANSFORM,{}).get('DefaultDependencyMappings',[])
-    dependencies = transform['resource'].get('DependsOn')
-    for mapping in dependency_mapping:
-      if dependencies:
-        logging.debug("%s: Attaching 'DependsOn: %s' to default resource %s", name, dependencies, name+mapping)
-        if output['Resources'][name+mapping].get('DependsOn'):
-          output['Resources'][name+mapping]['DependsOn'] += dependencies
-        else:
-          output['Resources'][name+mapping]['DependsOn'] = dependencies
-    logging.debug("%s: Replacing transformed output values in main stack", name)
-    for key,value in output.get('Outputs', {}).items():
-      replaced_value = value['Value']
-      logging.debug("--> Replacing %s value with %s", key, replaced_value)
-      search_and_replace(data, key, replaced_value, as_value=True)
-    transform_data = { 
-      'Resources': output.get('Resources', {}),
-      'Mappings': output.get('Mappings', {}),
-      'Conditions': output.get('Conditions', {})
-    }
-    data = combine(data,transform_data,recursive=True)
-    del data['Resources'][transform['name']]
-    # Finally replace any DependsOn references to transform with the default dependency mapping
-    if dependency_mapping:
-      renamed_dependency_mapping = [name+mapping for mapping in dependency_mapping]
-      logging.debug("%s: Replacing '%s' dependencies with default mapping %s", name, name, renamed_dependency_mapping)
-      search_and_replace(data, name, renamed_dependency_mapping, as_value=True)
+  with report_timer(report, 'stage3'):
+    for transform in transforms:
+      with report_timer(report, 'stage3', transform['name']):
+        merge_transform(index, data, transform, report)
+
+  report['time'] = time.time() - start
+  if report_path:
+    with open(report_path, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
   return data
 
+# Renames any references to transform outputs in main stack
+def rename_output_references(index, transform):
+  name = transform['name']
+  logging.debug("%s: Renaming input references in main stack", name)
+  for key in transform['output'].get('Outputs', {}).keys():
+    logging.debug("--> Renaming %s.%s to %s", name, key, name+key)
+    index_search_and_replace(index, None, '%s.%s' % (name, key), name+key)
+    logging.debug("--> Replacing {'Fn::GetAtt': ['%s','%s']} with %s", name, key, {'Ref': name+key})
+    index_search_and_replace(index, None, {'Fn::GetAtt': [name,key]}, {'Ref': name+key})
+
+# Processes a transform template, renaming template resources and replacing transform input parameter values
+def process_transform(index, data, transform):
+  name = transform['name']
+  resource = transform['resource']
+  resource_properties = resource['Properties']
+  output = transform['output']
+  output_parameters = output.get('Parameters', {})
+
+  # Rename keys in Resources, Mappings, Conditions and Outputs
+  logging.debug("%s: Renaming transform references", name)
+  for section in ['Resources','Mappings','Conditions','Outputs']:
+    for key in list(output.get(section, {}).keys()):
+      # Check if renamed resources will clash with main stack
+      if section != 'Outputs' and name+key in data.get(section, {}).keys():
+        raise AnsibleError("ERROR: The key %s in transform %s clashes with object %s in main stack '%s'" % (key, name, name+key, section))
+      rename_key(index, output[section], key, name+key)
+      logging.debug("--> Renaming %s to %s", key, name+key)
+      index_search_and_replace(index, name, key, name+key)
+
+  # Fix conditions that will result in illegally referencing a resource
+  logging.debug("%s: Evaluating conditions that reference a resource or stack export", name)
+  for output_param_key, output_param_value in output_parameters.items():
+    resource_property = resource_properties.get(output_param_key)
+    if resource_property:
+      fix_conditions(data, output, output_param_key, output_param_value, resource_property, index['stats'])
+
+  # Process input parameters
+  logging.debug("%s: Replacing transform input parameter values", name)
+  for output_param_key, output_param_value in output_parameters.items():
+    # Get corresponding transform input property from main stack
+    resource_property = resource_properties.get(output_param_key)
+    if resource_property:
+      # Replace input parameter values with the transform input property value
+      logging.debug("--> Replacing %s value with %s", output_param_key, resource_property)
+      index_search_and_replace(index, name, output_param_key, resource_property, as_value=True)
+    else:
+      # Replace input parameter values with input parameter default or raise error
+      default_value = output_param_value.get('Default')
+      if default_value is None:
+        raise AnsibleError("Transform parameter %s is missing associated transform property and default value" % output_param_key)
+      logging.debug("--> Replacing %s value with %s", output_param_key, default_value)
+      index_search_and_replace(index, name, output_param_key, default_value, as_value=True)
+
+# Replaces references to transform outputs with transformed output values and merges the transform into main stack
+def merge_transform(index, data, transform, report):
+  name = transform['name']
+  output = transform['output']
+  dependency_mapping = output.get('Metadata',{}).get(STACK_TRANSFORM,{}).get('DefaultDependencyMappings',[])
+  dependencies = transform['resource'].get('DependsOn')
+  for mapping in dependency_mapping:
+    if dependencies:
+      logging.debug("%s: Attaching 'DependsOn: %s' to default resource %s", name, dependencies, name+mapping)
+      if output['Resources'][name+mapping].get('DependsOn'):
+        output['Resources'][name+mapping]['DependsOn'] += dependencies
+      else:
+        output['Resources'][name+mapping]['DependsOn'] = dependencies
+      index_reference(index, output['Resources'][name+mapping], 'DependsOn', output['Resources'][name+mapping]['DependsOn'])
+  logging.debug("%s: Replacing transformed output values in main stack", name)
+  for key,value in output.get('Outputs', {}).items():
+    replaced_value = value['Value']
+    logging.debug("--> Replacing %s value with %s", key, replaced_value)
+    index_search_and_replace(index, None, key, replaced_value, as_value=True)
+  transform_data = { 
+    'Resources': output.get('Resources', {}),
+    'Mappings': output.get('Mappings', {}),
+    'Conditions': output.get('Conditions', {})
+  }
+  merge_start = time.time()
+  merge_into(data, transform_data)
+  report['transforms'][name]['merge'] = dict(
+    [(section, len(transform_data[section])) for section in transform_data],
+    time=time.time() - merge_start,
+    stack_resources=len(data['Resources']) - 1
+  )
+  del data['Resources'][transform['name']]
+  for section in transform_data.keys():
+    move_section(index, output, section, None)
+  # Finally replace any DependsOn references to transform with the default dependency mapping
+  if dependency_mapping:
+    renamed_dependency_mapping = [name+mapping for mapping in dependency_mapping]
+    logging.debug("%s: Replacing '%s' dependencies with default mapping %s", name, name, renamed_dependency_mapping)
+    index_search_and_replace(index, None, name, renamed_dependency_mapping, as_value=True)
+
 def property_transform(data, filter_paths=[]):
   # Load Ansible filters
-  filter_paths += [os.getcwd() + '/filter_plugins']
+  filter_paths = filter_paths + [os.getcwd() + '/filter_plugins']
   filters = ansible_filters(filter_paths)
   # Get transform properties - {Stack}.Resources.<Resource>.Properties.<Property>.Property::Transform
   transforms = [ 
@@ -283,7 +644,7 @@ def property_transform(data, filter_paths=[]):
     for resource_key, resource_value in data['Resources'].items()
       if resource_value.get('Properties')
     for property_key, property_value in resource_value.get('Properties').items()
-      if type(property_value) is dict and property_value.get(PROPERTY_TRANSFORM)
+      if isinstance(property_value, dict) and property_value.get(PROPERTY_TRANSFORM)
   ]
   for transform in transforms:
     property = transform['property']
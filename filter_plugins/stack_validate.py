@@ -0,0 +1,163 @@
+from ansible.errors import AnsibleFilterError
+import re
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+class FilterModule(object):
+  ''' Validates the references of a generated template before deployment '''
+  def filters(self):
+    return {
+      'stack_reference_errors': stack_reference_errors,
+      'stack_validate': stack_validate
+    }
+
+PSEUDO_PARAMETERS = [
+  'AWS::AccountId',
+  'AWS::NotificationARNs',
+  'AWS::NoValue',
+  'AWS::Partition',
+  'AWS::Region',
+  'AWS::StackId',
+  'AWS::StackName',
+  'AWS::URLSuffix'
+]
+SUB_VARIABLE = re.compile(r'\$\{([^!}][^}]*)\}')
+
+def path_join(path, key):
+  return '%s[%d]' % (path, key) if type(key) is int else '%s.%s' % (path, key) if path else key
+
+class ReferenceValidator(object):
+  ''' Checks every intrinsic function reference of a template against an index of the template's logical names '''
+  def __init__(self, data):
+    self.parameters = set(data.get('Parameters') or {}) | set(PSEUDO_PARAMETERS)
+    self.resources = set(data.get('Resources') or {})
+    self.conditions = set(data.get('Conditions') or {})
+    self.mappings = dict((k, v) for k, v in (data.get('Mappings') or {}).items() if isinstance(v, dict))
+    self.errors = []
+
+  def error(self, path, message):
+    self.errors.append('%s: %s' % (path, message))
+
+  def check_ref(self, path, name, resources=True):
+    if not isinstance(name, basestring):
+      return
+    if name in self.parameters or (resources and name in self.resources):
+      return
+    if name in self.resources:
+      self.error(path, "Ref to resource %s is not allowed in conditions" % name)
+    else:
+      self.error(path, "Ref to undefined parameter or resource %s" % name)
+
+  def check_resource(self, path, name, function):
+    if isinstance(name, basestring) and name not in self.resources:
+      self.error(path, "%s references undefined resource %s" % (function, name))
+
+  def check_condition(self, path, name):
+    if isinstance(name, basestring) and name not in self.conditions:
+      self.error(path, "Condition %s is not defined" % name)
+
+  def check_get_att(self, path, args):
+    if isinstance(args, basestring):
+      args = args.split('.', 1)
+    if isinstance(args, list) and args:
+      self.check_resource(path, args[0], 'Fn::GetAtt')
+
+  def check_sub(self, path, args, resources):
+    template, variables = (args[0], args[1]) if isinstance(args, list) and len(args) == 2 else (args, {})
+    if not isinstance(template, basestring) or not isinstance(variables, dict):
+      return
+    for token in SUB_VARIABLE.findall(template):
+      token = token.strip()
+      if token in variables or token in self.parameters or (resources and token in self.resources):
+        continue
+      name = token.split('.', 1)[0]
+      if '.' in token and resources and name in self.resources:
+        continue
+      self.error(path, "Fn::Sub variable ${%s} is not a parameter, resource or Fn::Sub variable" % token)
+    self.visit(path_join(path, 1), variables, resources)
+
+  def check_find_in_map(self, path, args):
+    if not isinstance(args, list) or len(args) < 3 or not isinstance(args[0], basestring):
+      return
+    mapping = self.mappings.get(args[0])
+    if mapping is None:
+      self.error(path, "Fn::FindInMap references undefined mapping %s" % args[0])
+    elif isinstance(args[1], basestring):
+      if args[1] not in mapping:
+        self.error(path, "Fn::FindInMap key %s is not defined in mapping %s" % (args[1], args[0]))
+      elif isinstance(args[2], basestring) and isinstance(mapping[args[1]], dict) and args[2] not in mapping[args[1]]:
+        self.error(path, "Fn::FindInMap key %s.%s is not defined in mapping %s" % (args[1], args[2], args[0]))
+
+  # Checks the intrinsic functions in a template node
+  # Resources can not be referenced in conditions, so resource references are disallowed in the Conditions section
+  def visit(self, path, node, resources=True):
+    if isinstance(node, list):
+      for index, value in enumerate(node):
+        self.visit(path_join(path, index), value, resources)
+      return
+    if not isinstance(node, dict):
+      return
+    if len(node) == 1:
+      function, args = list(node.items())[0]
+      function_path = path_join(path, function)
+      if function == 'Ref':
+        return self.check_ref(function_path, args, resources)
+      if function == 'Fn::GetAtt':
+        return self.check_get_att(function_path, args)
+      if function == 'Fn::Sub':
+        return self.check_sub(function_path, args, resources)
+      if function == 'Fn::Transform':
+        return
+      if function == 'Fn::FindInMap':
+        self.check_find_in_map(function_path, args)
+      elif function == 'Fn::If' and isinstance(args, list) and args:
+        self.check_condition(path_join(function_path, 0), args[0])
+      elif function == 'Condition' and not resources:
+        return self.check_condition(function_path, args)
+    for key, value in node.items():
+      self.visit(path_join(path, key), value, resources)
+
+  def validate(self, data):
+    for name, condition in (data.get('Conditions') or {}).items():
+      self.visit(path_join('Conditions', name), condition, resources=False)
+    for name, resource in (data.get('Resources') or {}).items():
+      path = path_join('Resources', name)
+      if not isinstance(resource, dict):
+        self.error(path, "Resource must be a dictionary")
+        continue
+      depends_on = resource.get('DependsOn') or []
+      for index, dependency in enumerate([depends_on] if isinstance(depends_on, basestring) else depends_on):
+        dependency_path = path_join(path, 'DependsOn') if isinstance(depends_on, basestring) else path_join(path_join(path, 'DependsOn'), index)
+        if dependency == name:
+          self.error(dependency_path, "Resource depends on itself")
+        else:
+          self.check_resource(dependency_path, dependency, 'DependsOn')
+      if 'Condition' in resource:
+        self.check_condition(path_join(path, 'Condition'), resource['Condition'])
+      for key, value in resource.items():
+        if key not in ['DependsOn', 'Condition']:
+          self.visit(path_join(path, key), value)
+    for name, output in (data.get('Outputs') or {}).items():
+      path = path_join('Outputs', name)
+      if isinstance(output, dict) and 'Condition' in output:
+        self.check_condition(path_join(path, 'Condition'), output['Condition'])
+      self.visit(path, dict((k, v) for k, v in output.items() if k != 'Condition') if isinstance(output, dict) else output)
+    return self.errors
+
+# Returns a list of errors for references in a template to undefined parameters, resources, conditions and mappings,
+# e.g. 'Resources.Instance.Properties.SubnetId.Ref: Ref to undefined parameter or resource Subnet'
+# Templates with a Transform are not validated, as transforms (e.g. AWS::Serverless) add resources during deployment
+def stack_reference_errors(data):
+  if data.get('Transform'):
+    return []
+  return ReferenceValidator(data).validate(data)
+
+# Returns a template unchanged if all references are valid, otherwise fails with all reference errors
+def stack_validate(data):
+  errors = stack_reference_errors(data)
+  if errors:
+    raise AnsibleFilterError("Template has %d invalid references:\n%s" % (len(errors), '\n'.join(errors)))
+  return data
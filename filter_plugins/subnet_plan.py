@@ -0,0 +1,77 @@
+from ansible.errors import AnsibleFilterError
+import copy
+import string
+
+try:
+  import netaddr
+  HAS_NETADDR = True
+except ImportError:
+  HAS_NETADDR = False
+
+class FilterModule(object):
+  ''' Allocates the subnets of each tier and availability zone of a VPC '''
+  def filters(self):
+    return {
+      'subnet_plan': subnet_plan
+    }
+
+ZONES = string.ascii_lowercase
+# Offset of the Amazon provided DNS server from the VPC network address
+DNS_SERVER_OFFSET = 2
+
+# Subnet plans are cached by VPC CIDR, tiers, availability zone count and subnet size
+PLANS = {}
+
+def allocate(vpc_cidr, tiers, az_count, size):
+  try:
+    vpc = netaddr.IPNetwork(vpc_cidr).cidr
+  except (netaddr.AddrFormatError, ValueError, TypeError) as e:
+    raise AnsibleFilterError("Invalid VPC CIDR %s: %s" % (vpc_cidr, e))
+  if az_count < 1 or az_count > len(ZONES):
+    raise AnsibleFilterError("Invalid availability zone count %d, must be between 1 and %d" % (az_count, len(ZONES)))
+  width = 32 if vpc.version == 4 else 128
+  if size < vpc.prefixlen or size > width:
+    raise AnsibleFilterError("Invalid subnet size /%d for VPC %s" % (size, vpc))
+  capacity = 2 ** (size - vpc.prefixlen)
+  count = len(tiers) * az_count
+  if count > capacity:
+    raise AnsibleFilterError(
+      "Subnet plan of %d /%d subnets (%d tiers in %d availability zones) does not fit in VPC %s, which has room for %d /%d subnets" %
+      (count, size, len(tiers), az_count, vpc, capacity, size)
+    )
+  step = 2 ** (width - size)
+  plan = {
+    'vpc_cidr': str(vpc),
+    'dns_server': str(vpc.network + DNS_SERVER_OFFSET),
+    'capacity': capacity,
+    'subnets': [],
+    'tiers': {}
+  }
+  for tier_index, tier in enumerate(tiers):
+    cidrs = []
+    for zone in range(az_count):
+      index = az_count * tier_index + zone
+      cidr = netaddr.IPNetwork('%s/%d' % (vpc.network + index * step, size))
+      cidrs.append(cidr)
+      plan['subnets'].append({
+        'tier': tier,
+        'zone': ZONES[zone],
+        'index': index,
+        'cidr': str(cidr)
+      })
+    plan['tiers'][tier] = {
+      'cidrs': [str(cidr) for cidr in cidrs],
+      'supernets': [str(cidr) for cidr in netaddr.cidr_merge(cidrs)]
+    }
+  return plan
+
+# Returns the subnet allocation of a VPC, where each tier has a subnet of the given size in each availability zone
+# Subnets are allocated in order of tier and then availability zone, as per ipsubnet(size, az_count * tier + zone).
+# The plan includes the subnets, the CIDRs and supernets of each tier and the Amazon provided DNS server address
+def subnet_plan(vpc_cidr, tiers, az_count=2, size=24):
+  if not HAS_NETADDR:
+    raise AnsibleFilterError('The subnet_plan filter requires python-netaddr be installed on the ansible controller')
+  key = (str(vpc_cidr), tuple(tiers), int(az_count), int(size))
+  if key not in PLANS:
+    PLANS[key] = allocate(key[0], list(tiers), key[2], key[3])
+  return copy.deepcopy(PLANS[key])
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: cloudformation_cached_facts
+short_description: Gathers facts about CloudFormation stacks, caching stack resources locally
+description:
+  - Returns the same C(cloudformation) facts as the M(cloudformation_facts) module with C(stack_resources) enabled,
+    for one or more stacks.
+  - Stack resources are cached locally keyed by stack ID and last updated time, and are only listed again if the
+    stack has been updated since the resources were cached.
+  - Many stacks are described in a single paginated pass.
+options:
+  stack_name:
+    description: Name of a stack, or a list of stack names.
+    required: true
+    aliases: [stack_names]
+  stack_resources:
+    description: Gathers the resources of each stack.
+    type: bool
+    default: true
+  cache_path:
+    description: Folder of cached stack resources.  Stack resources are not cached if not specified.
+  region:
+    description: AWS region.
+    aliases: [aws_region, ec2_region]
+  profile:
+    description: AWS credentials profile.
+    aliases: [aws_profile]
+  endpoint_url:
+    description: CloudFormation endpoint URL, for example a local CloudFormation stand-in.
+requirements: [boto3]
+'''
+
+EXAMPLES = '''
+- cloudformation_cached_facts:
+    stack_name: [network, proxy, ecs]
+    cache_path: build/facts/dev
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.stack_deploy import HAS_BOTO3, aws_client, collect_stack_facts
+
+try:
+  from botocore.exceptions import ClientError
+except ImportError:
+  pass  # handled by HAS_BOTO3
+
+def main():
+  module = AnsibleModule(
+    argument_spec=dict(
+      stack_name=dict(required=True, type='list', aliases=['stack_names']),
+      stack_resources=dict(type='bool', default=True),
+      cache_path=dict(type='path'),
+      region=dict(aliases=['aws_region', 'ec2_region']),
+      profile=dict(aliases=['aws_profile']),
+      endpoint_url=dict()
+    ),
+    supports_check_mode=True
+  )
+  if not HAS_BOTO3:
+    module.fail_json(msg='boto3 is required for this module')
+  params = module.params
+  cfn = aws_client('cloudformation', params['region'], params['profile'], params['endpoint_url'])
+  try:
+    facts, cached = collect_stack_facts(cfn, params['stack_name'], params['cache_path'], params['stack_resources'])
+  except ClientError as e:
+    module.fail_json(msg=str(e))
+  module.exit_json(changed=False, cached=cached, ansible_facts={'cloudformation': facts})
+
+if __name__ == '__main__':
+  main()
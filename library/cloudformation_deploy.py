@@ -0,0 +1,124 @@
+#!/usr/bin/python
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: cloudformation_deploy
+short_description: Deploys a CloudFormation stack using change sets
+description:
+  - Creates and executes a change set for a CloudFormation stack using boto3, waiting for the stack to
+    complete by polling stack events with backoff.
+  - Returns the same C(cloudformation) facts as the M(cloudformation_facts) module with C(stack_resources) enabled.
+options:
+  stack_name:
+    description: Name of the stack.
+    required: true
+  template:
+    description: Path of the stack template file.
+    required: true
+  parameters:
+    description: Stack parameter values.  Template parameters without a value keep their previous value.
+    default: {}
+  tags:
+    description: Stack tags.
+    default: {}
+  capabilities:
+    description: Stack capabilities.
+    default: [CAPABILITY_NAMED_IAM, CAPABILITY_AUTO_EXPAND]
+  role_arn:
+    description: ARN of the IAM role CloudFormation assumes to deploy the stack.
+  disable_rollback:
+    description: Disables rollback of the stack on failure.
+    type: bool
+    default: false
+  s3_bucket:
+    description: S3 bucket to upload the template to.  The template is passed in the request if not specified.
+  s3_prefix:
+    description: S3 key prefix of the uploaded template.
+    default: ''
+  region:
+    description: AWS region.
+    aliases: [aws_region, ec2_region]
+  profile:
+    description: AWS credentials profile.
+    aliases: [aws_profile]
+  endpoint_url:
+    description: CloudFormation and S3 endpoint URL, for example a local CloudFormation stand-in.
+  timeout:
+    description: Maximum time in seconds to wait for the deployment.
+    default: 3600
+  cache_path:
+    description: Folder of cached stack resources, as per M(cloudformation_cached_facts).  Stack resources are not cached if not specified.
+requirements: [boto3]
+'''
+
+EXAMPLES = '''
+- cloudformation_deploy:
+    stack_name: my-stack
+    template: build/dev-my-stack-stack.yml
+    parameters:
+      Environment: dev
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.stack_deploy import (
+  CAPABILITIES, HAS_BOTO3, DeployError, aws_client, collect_stack_facts, deploy_stack
+)
+
+try:
+  from botocore.exceptions import ClientError
+except ImportError:
+  pass  # handled by HAS_BOTO3
+
+def main():
+  module = AnsibleModule(
+    argument_spec=dict(
+      stack_name=dict(required=True),
+      template=dict(required=True, type='path'),
+      parameters=dict(type='dict', default={}),
+      tags=dict(type='dict', default={}),
+      capabilities=dict(type='list', default=CAPABILITIES),
+      role_arn=dict(),
+      disable_rollback=dict(type='bool', default=False),
+      s3_bucket=dict(),
+      s3_prefix=dict(default=''),
+      region=dict(aliases=['aws_region', 'ec2_region']),
+      profile=dict(aliases=['aws_profile']),
+      endpoint_url=dict(),
+      timeout=dict(type='int', default=3600),
+      cache_path=dict(type='path')
+    )
+  )
+  if not HAS_BOTO3:
+    module.fail_json(msg='boto3 is required for this module')
+  params = module.params
+  cfn = aws_client('cloudformation', params['region'], params['profile'], params['endpoint_url'])
+  s3 = aws_client('s3', params['region'], params['profile'], params['endpoint_url']) if params['s3_bucket'] else None
+  with open(params['template']) as f:
+    template_body = f.read()
+  try:
+    result = deploy_stack(
+      cfn, params['stack_name'], template_body,
+      parameters=params['parameters'],
+      tags=params['tags'],
+      capabilities=params['capabilities'],
+      role_arn=params['role_arn'],
+      disable_rollback=params['disable_rollback'],
+      s3=s3,
+      s3_bucket=params['s3_bucket'],
+      s3_prefix=params['s3_prefix'],
+      timeout=params['timeout']
+    )
+  except DeployError as e:
+    module.fail_json(msg=str(e), **e.result)
+  except ClientError as e:
+    module.fail_json(msg=str(e))
+  try:
+    facts = collect_stack_facts(cfn, [params['stack_name']], params['cache_path'])[0]
+  except ClientError as e:
+    module.fail_json(msg=str(e), **result)
+  result['ansible_facts'] = {'cloudformation': facts}
+  module.exit_json(**result)
+
+if __name__ == '__main__':
+  main()
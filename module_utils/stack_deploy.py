@@ -0,0 +1,355 @@
+''' Deploys CloudFormation stacks using change sets, shared by the cloudformation_deploy module and scripts '''
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import yaml
+from multiprocessing.pool import ThreadPool
+
+try:
+  import boto3
+  from botocore.config import Config
+  from botocore.exceptions import ClientError
+  HAS_BOTO3 = True
+except ImportError:
+  HAS_BOTO3 = False
+
+try:
+  from yaml import CSafeLoader as SafeLoader
+except ImportError:
+  from yaml import SafeLoader
+
+CAPABILITIES = ['CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
+SUCCESS_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'IMPORT_COMPLETE']
+NO_CHANGES = ["The submitted information didn't contain changes", "No updates are to be performed"]
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+# Minimum number of stacks to describe all stacks in a single paginated pass, rather than each stack individually
+BATCH_THRESHOLD = 5
+
+# AWS clients shared by all deployments in this process, keyed by service, region, profile and endpoint
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+
+class DeployError(Exception):
+  ''' Raised when a stack deployment fails '''
+  def __init__(self, message, result=None):
+    super(DeployError, self).__init__(message)
+    self.result = result or {}
+
+class Backoff(object):
+  ''' Polling delay that increases geometrically while a poll makes no progress, and resets on progress '''
+  def __init__(self, minimum=2, maximum=30, factor=1.5):
+    self.minimum = minimum
+    self.maximum = maximum
+    self.factor = factor
+    self.delay = minimum
+
+  def wait(self, progress=False):
+    self.delay = self.minimum if progress else min(self.delay * self.factor, self.maximum)
+    time.sleep(self.delay)
+
+# Returns a shared AWS client, with a connection pool sized for concurrent deployments
+def aws_client(service, region=None, profile=None, endpoint_url=None, max_pool_connections=10):
+  key = (service, region, profile, endpoint_url)
+  with CLIENTS_LOCK:
+    if key not in CLIENTS:
+      session = boto3.session.Session(profile_name=profile, region_name=region)
+      CLIENTS[key] = session.client(
+        service,
+        endpoint_url=endpoint_url,
+        config=Config(max_pool_connections=max_pool_connections, retries={'max_attempts': 10})
+      )
+    return CLIENTS[key]
+
+# Converts a CamelCase name to snake_case, as per camel_dict_to_snake_dict in Ansible
+def camel_to_snake(name):
+  name = re.sub(r'[A-Z]{3,}s$', lambda m: '_' + m.group(0).lower(), name)
+  if name.startswith('_'):
+    name = name[1:]
+  name = re.sub(r'(.)([A-Z][a-z]+)', r'\1_\2', name)
+  return re.sub(r'([a-z0-9])([A-Z]+)', r'\1_\2', name).lower()
+
+def camel_dict_to_snake_dict(data):
+  if type(data) is dict:
+    return dict((camel_to_snake(k), camel_dict_to_snake_dict(v)) for k, v in data.items())
+  if type(data) is list:
+    return [camel_dict_to_snake_dict(item) for item in data]
+  return data
+
+# Converts datetimes in API responses to ISO 8601 strings
+def serializable(data):
+  if type(data) is dict:
+    return dict((k, serializable(v)) for k, v in data.items())
+  if type(data) is list:
+    return [serializable(item) for item in data]
+  if isinstance(data, (datetime.datetime, datetime.date)):
+    return data.isoformat()
+  return data
+
+def to_dict(items, key, value):
+  return dict((item[key], item.get(value)) for item in items or [])
+
+# Returns a stack description, or None if the stack does not exist
+def describe_stack(cfn, stack_name):
+  try:
+    return cfn.describe_stacks(StackName=stack_name)['Stacks'][0]
+  except ClientError as e:
+    if 'does not exist' in e.response['Error']['Message']:
+      return None
+    raise
+
+# Returns the resource summaries of a stack
+def stack_resource_list(cfn, stack_name):
+  return [
+    resource
+    for page in cfn.get_paginator('list_stack_resources').paginate(StackName=stack_name)
+    for resource in page['StackResourceSummaries']
+  ]
+
+# Returns stack facts for a stack description in the same form as the cloudformation_facts module
+def description_facts(description, resource_list=None):
+  facts = {
+    'stack_outputs': to_dict(description.get('Outputs'), 'OutputKey', 'OutputValue'),
+    'stack_parameters': to_dict(description.get('Parameters'), 'ParameterKey', 'ParameterValue'),
+    'stack_tags': to_dict(description.get('Tags'), 'Key', 'Value'),
+    'stack_description': camel_dict_to_snake_dict(description)
+  }
+  if resource_list is not None:
+    facts['stack_resource_list'] = resource_list
+    facts['stack_resources'] = to_dict(resource_list, 'LogicalResourceId', 'PhysicalResourceId')
+  return serializable(facts)
+
+# Returns descriptions of stacks by name, describing all stacks in a single paginated pass for many stacks
+def describe_stacks(cfn, stack_names, batch_threshold=BATCH_THRESHOLD):
+  if len(stack_names) < batch_threshold:
+    return dict((name, describe_stack(cfn, name)) for name in stack_names)
+  descriptions = dict(
+    (stack['StackName'], stack)
+    for page in cfn.get_paginator('describe_stacks').paginate()
+    for stack in page['Stacks']
+  )
+  return dict((name, descriptions.get(name)) for name in stack_names)
+
+# Returns the cache key of a stack description, which changes whenever the stack is updated
+# Stacks with an operation in progress are not cached
+def facts_cache_key(description):
+  if description['StackStatus'].endswith('_IN_PROGRESS'):
+    return None
+  return '%s@%s@%s' % (
+    description['StackId'], serializable(description.get('LastUpdatedTime') or description['CreationTime']), description['StackStatus']
+  )
+
+# Writes a cache file atomically, so that concurrent readers never see a partial file
+def write_cache(cache_file, data):
+  try:
+    os.makedirs(os.path.dirname(cache_file))
+  except OSError:
+    if not os.path.isdir(os.path.dirname(cache_file)):
+      raise
+  temp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+  with open(temp_file, 'w') as f:
+    json.dump(data, f)
+  os.rename(temp_file, cache_file)
+
+# Reads a cache file, returning an empty entry if the file does not exist or is truncated or corrupt
+# Unreadable entries are treated as a cache miss, and are rewritten with the stack's current resources
+def read_cache(cache_file):
+  try:
+    with open(cache_file) as f:
+      entry = json.load(f)
+  except (IOError, OSError, ValueError):
+    return {}
+  return entry if isinstance(entry, dict) and isinstance(entry.get('Resources'), list) else {}
+
+# Returns stack facts for multiple stacks, as a dict of stack name to facts, and the names of stacks with cached resources
+# Stack resources are cached in a JSON file per stack in cache_path, and are only listed again if the stack was updated
+# since the resources were cached.  Stack descriptions, outputs, parameters and tags are always current
+def collect_stack_facts(cfn, stack_names, cache_path=None, stack_resources=True):
+  facts, cached = {}, []
+  for name, description in describe_stacks(cfn, stack_names).items():
+    if description is None:
+      facts[name] = {}
+      continue
+    if not stack_resources:
+      facts[name] = description_facts(description)
+      continue
+    key = facts_cache_key(description)
+    cache_file = os.path.join(cache_path, name + '.json') if cache_path else None
+    entry = read_cache(cache_file) if cache_file else {}
+    if key and entry.get('Key') == key:
+      resource_list = entry['Resources']
+      cached.append(name)
+    else:
+      resource_list = serializable(stack_resource_list(cfn, description['StackId']))
+      if key and cache_file:
+        write_cache(cache_file, {'Key': key, 'Resources': resource_list})
+    facts[name] = description_facts(description, resource_list)
+  return facts, sorted(cached)
+
+# Returns stack parameters for the parameters declared in a template
+# Parameters without a value keep their previous value for an existing stack, as per 'aws cloudformation deploy'
+def stack_parameters(template_body, parameters, stack=None):
+  declared = (yaml.load(template_body, Loader=SafeLoader) or {}).get('Parameters') or {}
+  previous = [p['ParameterKey'] for p in (stack or {}).get('Parameters', [])]
+  result = []
+  for key in sorted(declared):
+    if key in parameters:
+      value = parameters[key]
+      value = ','.join('%s' % v for v in value) if type(value) is list else '%s' % value
+      result.append({'ParameterKey': key, 'ParameterValue': value})
+    elif key in previous:
+      result.append({'ParameterKey': key, 'UsePreviousValue': True})
+  return result
+
+# Uploads a template to S3 keyed by its content hash, returning the template URL
+# Keys match the keys of 'aws cloudformation deploy', and existing objects with the same content are not uploaded again
+# CloudFormation limits templates in S3 to 1 MB, so templates are always uploaded with a single request
+def upload_template(s3, bucket, prefix, template_body):
+  body = template_body.encode('utf-8')
+  key = '/'.join(p for p in [prefix.strip('/'), '%s.template' % hashlib.md5(body).hexdigest()] if p)
+  url = '%s/%s/%s' % (s3.meta.endpoint_url, bucket, key)
+  try:
+    s3.head_object(Bucket=bucket, Key=key)
+    return url
+  except ClientError as e:
+    if e.response['Error']['Code'] not in ['404', 'NoSuchKey', 'NotFound']:
+      raise
+  s3.put_object(Bucket=bucket, Key=key, Body=body)
+  return url
+
+# Waits for a change set to be created, returning the change set with all changes
+def wait_change_set(cfn, change_set_id, backoff, deadline):
+  while True:
+    change_set = cfn.describe_change_set(ChangeSetName=change_set_id)
+    if change_set['Status'] not in ['CREATE_PENDING', 'CREATE_IN_PROGRESS']:
+      break
+    if time.time() > deadline:
+      raise DeployError("Timed out waiting for change set %s" % change_set_id)
+    backoff.wait()
+  changes = change_set.get('Changes', [])
+  while change_set.get('NextToken'):
+    change_set = cfn.describe_change_set(ChangeSetName=change_set_id, NextToken=change_set['NextToken'])
+    changes += change_set.get('Changes', [])
+  change_set['Changes'] = changes
+  return change_set
+
+# Returns stack events since a timestamp that have not been seen, oldest first
+def new_stack_events(cfn, stack_id, since, seen):
+  events = []
+  for page in cfn.get_paginator('describe_stack_events').paginate(StackName=stack_id):
+    for event in page['StackEvents']:
+      if event['EventId'] in seen or event['Timestamp'] < since:
+        return list(reversed(events))
+      seen.add(event['EventId'])
+      events.append(event)
+  return list(reversed(events))
+
+# Polls stack events until the stack reaches a terminal status, returning the stack and events
+# The polling delay backs off while there are no new events, and stack status is only described
+# when a stack event indicates the stack may have completed or the delay has backed off completely
+def wait_stack(cfn, stack_id, since, backoff, deadline, log=None):
+  seen, events = set(), []
+  while True:
+    batch = new_stack_events(cfn, stack_id, since, seen)
+    events += batch
+    for event in batch:
+      if log:
+        log(event)
+    completed = any(
+      e['ResourceType'] == STACK_RESOURCE_TYPE and e['PhysicalResourceId'] == stack_id
+      and not e['ResourceStatus'].endswith('_IN_PROGRESS')
+      for e in batch
+    )
+    if completed or backoff.delay >= backoff.maximum:
+      stack = describe_stack(cfn, stack_id)
+      if not stack['StackStatus'].endswith('_IN_PROGRESS'):
+        return stack, events
+    if time.time() > deadline:
+      raise DeployError("Timed out waiting for stack %s" % stack_id)
+    backoff.wait(bool(batch))
+
+# Creates and executes a change set for a stack, waiting for the stack update to complete
+def deploy_stack(cfn, stack_name, template_body, parameters={}, tags={}, capabilities=CAPABILITIES,
+                 role_arn=None, disable_rollback=False, s3=None, s3_bucket=None, s3_prefix='',
+                 timeout=3600, log=None):
+  deadline = time.time() + timeout
+  stack = describe_stack(cfn, stack_name)
+  if stack and stack['StackStatus'] == 'ROLLBACK_COMPLETE':
+    raise DeployError("Stack %s is in ROLLBACK_COMPLETE state and must be deleted before it can be deployed" % stack_name)
+  change_set_type = 'UPDATE' if stack and stack['StackStatus'] != 'REVIEW_IN_PROGRESS' else 'CREATE'
+  args = {
+    'StackName': stack_name,
+    'ChangeSetName': 'deploy-%s' % time.strftime('%Y%m%d%H%M%S'),
+    'ChangeSetType': change_set_type,
+    'Parameters': stack_parameters(template_body, parameters, stack),
+    'Capabilities': capabilities,
+    'Tags': [{'Key': k, 'Value': '%s' % v} for k, v in sorted(tags.items())]
+  }
+  if s3_bucket:
+    args['TemplateURL'] = upload_template(s3, s3_bucket, s3_prefix, template_body)
+  else:
+    args['TemplateBody'] = template_body
+  if role_arn:
+    args['RoleARN'] = role_arn
+  try:
+    change_set_id = cfn.create_change_set(**args)['Id']
+  except ClientError as e:
+    if any(message in e.response['Error']['Message'] for message in NO_CHANGES):
+      return {
+        'stack_name': stack_name,
+        'stack_id': stack['StackId'],
+        'changes': [],
+        'changed': False,
+        'stack_status': stack['StackStatus'],
+        'events': []
+      }
+    raise
+  change_set = wait_change_set(cfn, change_set_id, Backoff(minimum=1, maximum=10), deadline)
+  result = {
+    'stack_name': stack_name,
+    'stack_id': change_set['StackId'],
+    'change_set_id': change_set_id,
+    'change_set_type': change_set_type,
+    'changes': [camel_dict_to_snake_dict(c.get('ResourceChange', {})) for c in change_set['Changes']]
+  }
+  if change_set['Status'] == 'FAILED':
+    reason = change_set.get('StatusReason', '')
+    if any(message in reason for message in NO_CHANGES):
+      cfn.delete_change_set(ChangeSetName=change_set_id)
+      return dict(result, changed=False, stack_status=stack['StackStatus'], events=[])
+    raise DeployError("Change set for stack %s failed: %s" % (stack_name, reason), result)
+  execute = {'ChangeSetName': change_set_id}
+  if disable_rollback:
+    execute['DisableRollback'] = True
+  cfn.execute_change_set(**execute)
+  stack, events = wait_stack(cfn, change_set['StackId'], change_set['CreationTime'], Backoff(), deadline, log)
+  result = dict(result, changed=True, stack_status=stack['StackStatus'], events=serializable(events))
+  if stack['StackStatus'] not in SUCCESS_STATUSES:
+    reasons = [
+      '%s %s: %s' % (e['LogicalResourceId'], e['ResourceStatus'], e.get('ResourceStatusReason'))
+      for e in events if e['ResourceStatus'].endswith('_FAILED')
+    ]
+    raise DeployError("Stack %s deployment failed with status %s: %s" % (stack_name, stack['StackStatus'], '; '.join(reasons)), result)
+  return result
+
+# Deploys multiple stacks concurrently, returning a result for each stack in order
+# Each stack is a dict of deploy_stack arguments, deployed using clients shared across all deployments
+def deploy_stacks(stacks, jobs=4, region=None, profile=None, endpoint_url=None, log=None):
+  cfn = aws_client('cloudformation', region, profile, endpoint_url, max_pool_connections=max(jobs, 10))
+  s3 = aws_client('s3', region, profile, endpoint_url, max_pool_connections=max(jobs, 10))
+  def deploy(stack):
+    try:
+      return deploy_stack(cfn, s3=s3, log=log, **stack)
+    except DeployError as e:
+      return dict(e.result, stack_name=stack['stack_name'], failed=True, msg=str(e))
+    except Exception as e:
+      return {'stack_name': stack['stack_name'], 'failed': True, 'msg': '%s: %s' % (type(e).__name__, e)}
+  pool = ThreadPool(max(min(jobs, len(stacks)), 1))
+  try:
+    return pool.map(deploy, stacks, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
@@ -0,0 +1,199 @@
+''' Plans the deployment order of CloudFormation stacks from the exports and Fn::ImportValue references of their templates '''
+import glob
+import json
+import os
+import re
+import yaml
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+try:
+  from yaml import CSafeLoader as SafeLoader
+except ImportError:
+  from yaml import SafeLoader
+
+CONFIG_SUFFIX = '-config.json'
+TEMPLATE_SUFFIX = '-stack.yml'
+SUB_VARIABLE = re.compile(r'\$\{([^}!]+)\}')
+
+class StackGraphError(Exception):
+  ''' Raised when stacks cannot be ordered, e.g. due to a cycle or a duplicate export '''
+  pass
+
+class Unresolved(Exception):
+  ''' Raised when an export or import name depends on a value that is only known at deploy time '''
+  pass
+
+# Returns the generated stack artifacts in build folders or template files as a dict of stack name to template
+# Stack names are the artifact names with the environment prefix removed, and later build folders take precedence
+def find_stacks(paths, env=None):
+  templates = []
+  for path in paths:
+    if os.path.isdir(path):
+      templates += sorted(glob.glob(os.path.join(path, '*' + TEMPLATE_SUFFIX)))
+    else:
+      templates.append(path)
+  stacks = {}
+  for template in templates:
+    name = os.path.basename(template)
+    name = name[:-len(TEMPLATE_SUFFIX)] if name.endswith(TEMPLATE_SUFFIX) else os.path.splitext(name)[0]
+    if env:
+      if not name.startswith(env + '-'):
+        continue
+      name = name[len(env) + 1:]
+    stacks[name] = template
+  return stacks
+
+# Loads a stack template and the parameter values of the stack config file alongside it
+def load_stack(template):
+  with open(template) as f:
+    body = yaml.load(f, Loader=SafeLoader) or {}
+  config_file = template[:-len(TEMPLATE_SUFFIX)] + CONFIG_SUFFIX if template.endswith(TEMPLATE_SUFFIX) else None
+  parameters = {}
+  if config_file and os.path.exists(config_file):
+    with open(config_file) as f:
+      parameters = json.load(f).get('Parameters') or {}
+  return body, parameters
+
+# Returns the values of template parameters and pseudo parameters that are known before deployment
+def known_values(stack_name, body, parameters, region=None):
+  values = dict(
+    (key, parameter['Default'])
+    for key, parameter in (body.get('Parameters') or {}).items()
+    if type(parameter) is dict and 'Default' in parameter
+  )
+  values.update(parameters)
+  values['AWS::StackName'] = stack_name
+  if region:
+    values['AWS::Region'] = region
+  return values
+
+# Resolves an export or import name expression using known parameter values
+def resolve_name(value, values):
+  if isinstance(value, basestring):
+    return value
+  if type(value) is dict and len(value) == 1:
+    function, args = list(value.items())[0]
+    if function == 'Ref' and args in values:
+      value = values[args]
+      return ','.join('%s' % v for v in value) if type(value) is list else '%s' % value
+    if function == 'Fn::Sub':
+      template, variables = (args[0], args[1]) if type(args) is list else (args, {})
+      local = dict(values, **dict((k, resolve_name(v, values)) for k, v in variables.items()))
+      def substitute(match):
+        if match.group(1) not in local:
+          raise Unresolved(match.group(0))
+        return '%s' % local[match.group(1)]
+      return SUB_VARIABLE.sub(substitute, template).replace('${!', '${')
+    if function == 'Fn::Join' and type(args) is list and len(args) == 2 and type(args[1]) is list:
+      return args[0].join(resolve_name(v, values) for v in args[1])
+  raise Unresolved(json.dumps(value, sort_keys=True))
+
+# Returns the Fn::ImportValue name expressions in a template node
+def find_imports(node):
+  if type(node) is dict:
+    if 'Fn::ImportValue' in node:
+      return [node['Fn::ImportValue']]
+    return [i for v in node.values() for i in find_imports(v)]
+  if type(node) is list:
+    return [i for v in node for i in find_imports(v)]
+  return []
+
+# Returns the export names and import names of a stack template
+# Names that cannot be resolved before deployment are returned separately as unresolved
+def stack_references(stack_name, body, parameters={}, region=None):
+  values = known_values(stack_name, body, parameters, region)
+  references = {'exports': [], 'imports': [], 'unresolved': []}
+  expressions = [
+    ('exports', output['Export'].get('Name'))
+    for output in (body.get('Outputs') or {}).values()
+    if type(output) is dict and type(output.get('Export')) is dict
+  ] + [
+    ('imports', expression)
+    for section in ['Conditions', 'Resources', 'Outputs']
+    for expression in find_imports(body.get(section) or {})
+  ]
+  for kind, expression in expressions:
+    try:
+      name = resolve_name(expression, values)
+      if name not in references[kind]:
+        references[kind].append(name)
+    except Unresolved as e:
+      references['unresolved'].append('%s %s' % (kind[:-1], e))
+  return references
+
+# Returns a cycle in a dependency graph, as a list of stack names starting and ending with the same stack
+def find_cycle(dependencies, nodes):
+  visiting, visited = [], set()
+  def visit(node):
+    if node in visiting:
+      return visiting[visiting.index(node):] + [node]
+    if node in visited:
+      return None
+    visiting.append(node)
+    for dependency in sorted(dependencies[node]):
+      cycle = visit(dependency)
+      if cycle:
+        return cycle
+    visiting.pop()
+    visited.add(node)
+  for node in sorted(nodes):
+    cycle = visit(node)
+    if cycle:
+      return cycle
+
+# Returns the dependency graph of stacks, as a dict of stack name to the stacks it imports from
+# Imports of names not exported by any of the stacks are treated as exports of stacks that are already deployed
+def stack_dependencies(references):
+  exporters = {}
+  for name in sorted(references):
+    for export in references[name]['exports']:
+      if export in exporters:
+        raise StackGraphError("Export %s is defined by stacks %s and %s" % (export, exporters[export], name))
+      exporters[export] = name
+  return dict(
+    (name, sorted(set(
+      exporters[i] for i in stack['imports'] if i in exporters and exporters[i] != name
+    )))
+    for name, stack in references.items()
+  )
+
+# Returns stacks in topological waves, where the stacks in each wave only depend on stacks in earlier waves
+def stack_waves(dependencies):
+  remaining = dict((name, set(deps)) for name, deps in dependencies.items())
+  waves = []
+  while remaining:
+    wave = sorted(name for name, deps in remaining.items() if not deps)
+    if not wave:
+      cycle = find_cycle(remaining, remaining)
+      raise StackGraphError("Stack dependency cycle: %s" % ' -> '.join(cycle))
+    waves.append(wave)
+    for name in wave:
+      del remaining[name]
+    for deps in remaining.values():
+      deps.difference_update(wave)
+  return waves
+
+# Plans the deployment of stacks given as a dict of stack name to generated template file
+def stack_plan(stacks, region=None):
+  references = {}
+  for name, template in stacks.items():
+    body, parameters = load_stack(template)
+    references[name] = stack_references(name, body, parameters, region)
+  dependencies = stack_dependencies(references)
+  exported = set(e for r in references.values() for e in r['exports'])
+  return {
+    'stacks': dict(
+      (name, dict(
+        references[name],
+        template=stacks[name],
+        dependencies=dependencies[name],
+        external=sorted(set(i for i in references[name]['imports'] if i not in exported))
+      ))
+      for name in stacks
+    ),
+    'waves': stack_waves(dependencies)
+  }
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+''' Benchmarks the filter plugin transform pipeline against synthetic stacks of increasing size '''
+from __future__ import division, print_function
+import argparse
+import copy
+import glob
+import importlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+import yaml
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+ROLE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROLE_PATH, 'filter_plugins'))
+
+import stack_transforms
+from cfn_dotted_dict import cfn_dotted_dict
+from dict_override import dict_override
+from stack_overrides import stack_overrides
+from stack_transforms import search_and_replace, stack_transform
+
+TEMPLATE_PATH = os.path.join(ROLE_PATH, 'templates')
+TEMPLATES = ['asg', 'ecs_instances', 'alb', 'elb', 'rds', 'efs', 'ecache', 'custom', 'event', 'ecs_tasks']
+RESOURCE_TYPES = ['AWS::SNS::Topic', 'AWS::SQS::Queue', 'AWS::S3::Bucket', 'AWS::Logs::LogGroup']
+
+# Local stand-in for the Ansible combine filter (as per merge_hash in Ansible 2.5 - 2.7)
+def combine(*terms, **kwargs):
+  recursive = kwargs.get('recursive', False)
+  def merge(a, b):
+    result = a.copy()
+    for k, v in b.items():
+      if recursive and k in result and isinstance(result[k], dict) and isinstance(v, dict):
+        result[k] = merge(result[k], v)
+      else:
+        result[k] = v
+    return result
+  result = {}
+  for term in terms:
+    result = merge(result, term)
+  return result
+
+# Local stand-ins for the Ansible core filters used by the role templates, plus the role's own filters
+def local_filters():
+  filters = {
+    'combine': combine,
+    'regex_replace': lambda value, pattern='', replacement='', ignorecase=False:
+      re.compile(pattern, flags=re.I if ignorecase else 0).sub(replacement, value),
+    'to_json': lambda value, **kwargs: json.dumps(value, **kwargs),
+    'to_nice_yaml': lambda value, indent=4, **kwargs:
+      yaml.safe_dump(value, indent=indent, allow_unicode=True, default_flow_style=False, **kwargs)
+  }
+  for path in sorted(glob.glob(os.path.join(ROLE_PATH, 'filter_plugins', '*.py'))):
+    module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+    if hasattr(module, 'FilterModule'):
+      filters.update(module.FilterModule().filters())
+  return filters
+
+# Returns the declared parameters of each transform template
+def template_parameters(templates):
+  parameters = {}
+  for template in templates:
+    with open(os.path.join(TEMPLATE_PATH, template + '.yml.j2')) as f:
+      parameters[template] = yaml.safe_load(f).get('Parameters') or {}
+  return parameters
+
+# Generates a synthetic stack with n resources and m transforms, each transform using a role template
+# Resources and transform properties reference parameters, resources and transform outputs using
+# Ref, Fn::GetAtt, Fn::Sub and DependsOn so that all transform stages are exercised
+def synthetic_stack(resources, transforms, templates, seed=1):
+  rnd = random.Random(seed)
+  parameters = template_parameters(templates)
+  stack_parameters = dict(('Param%d' % i, {'Type': 'String', 'Default': 'value%d' % i}) for i in range(10))
+  conditions = dict(('Condition%d' % i, {'Fn::Equals': [{'Ref': 'Param%d' % i}, 'true']}) for i in range(5))
+  resource_keys = ['Resource%d' % i for i in range(resources)]
+  transform_outputs = {}
+  data = {}
+  for i in range(transforms):
+    template = templates[i % len(templates)]
+    name = ''.join(part.title() for part in template.split('_')) + str(i)
+    properties = {}
+    for key, value in parameters[template].items():
+      if 'AllowedValues' in value:
+        properties[key] = value['AllowedValues'][0]
+        continue
+      if 'Default' in value and rnd.random() < 0.5:
+        continue
+      choice = rnd.random()
+      if choice < 0.25:
+        properties[key] = {'Ref': rnd.choice(sorted(stack_parameters))}
+      elif choice < 0.4 and resource_keys:
+        properties[key] = {'Ref': rnd.choice(resource_keys)}
+      elif choice < 0.5 and resource_keys:
+        properties[key] = {'Fn::GetAtt': [rnd.choice(resource_keys), 'Arn']}
+      elif choice < 0.6:
+        properties[key] = {'Fn::ImportValue': 'Export%d' % i}
+      elif choice < 0.7:
+        properties[key] = {'Fn::Sub': '${AWS::StackName}-%s-${%s}' % (key, rnd.choice(sorted(stack_parameters)))}
+      else:
+        properties[key] = 'literal-%s' % key
+    data[name] = {'Type': 'Stack::Transform', 'Template': template + '.yml.j2', 'Properties': properties}
+    if resource_keys and rnd.random() < 0.5:
+      data[name]['DependsOn'] = [rnd.choice(resource_keys)]
+    with open(os.path.join(TEMPLATE_PATH, template + '.yml.j2')) as f:
+      transform_outputs[name] = sorted(yaml.safe_load(f).get('Outputs') or {})
+  for i, key in enumerate(resource_keys):
+    properties = {'Name': {'Fn::Sub': '${AWS::StackName}-%s' % key}, 'Value': {'Ref': rnd.choice(sorted(stack_parameters))}}
+    resource = {'Type': RESOURCE_TYPES[i % len(RESOURCE_TYPES)], 'Properties': properties}
+    names = [name for name in sorted(transform_outputs) if transform_outputs[name]]
+    if names and rnd.random() < 0.7:
+      name = rnd.choice(names)
+      output = rnd.choice(transform_outputs[name])
+      choice = rnd.random()
+      if choice < 0.3:
+        properties['Input'] = {'Ref': '%s.%s' % (name, output)}
+      elif choice < 0.6:
+        properties['Input'] = {'Fn::GetAtt': [name, output]}
+      else:
+        properties['Input'] = {'Fn::Sub': 'arn:${AWS::Partition}:${%s.%s}/path' % (name, output)}
+      if rnd.random() < 0.5:
+        resource['DependsOn'] = [name]
+    if rnd.random() < 0.3:
+      resource['Condition'] = rnd.choice(sorted(conditions))
+    if i and rnd.random() < 0.5:
+      properties['Previous'] = {'Fn::GetAtt': [resource_keys[i - 1], 'Arn']}
+    properties['Items'] = [{'Name': 'item%d' % j, 'Value': j} for j in range(3)]
+    data[key] = resource
+  outputs = dict(
+    (name + output + 'Output', {'Value': {'Ref': '%s.%s' % (name, output)}})
+    for name in transform_outputs for output in transform_outputs[name]
+  )
+  return {
+    'AWSTemplateFormatVersion': '2010-09-09',
+    'Description': 'Synthetic benchmark stack',
+    'Parameters': stack_parameters,
+    'Conditions': conditions,
+    'Resources': data,
+    'Outputs': outputs
+  }
+
+# Generates synthetic host variables with k complex override selectors, k dotted variables,
+# AWS:: resource type globals and unrelated variables, as per a typical environment
+def synthetic_vars(stack, selectors, seed=1):
+  rnd = random.Random(seed)
+  resource_keys = sorted(k for k, v in stack['Resources'].items() if v['Type'] in RESOURCE_TYPES) or ['Resource0']
+  variables = dict(('var_%d' % i, 'value%d' % i) for i in range(selectors * 10))
+  for i in range(selectors):
+    key = rnd.choice(resource_keys)
+    choice = i % 4
+    if choice == 0:
+      variables['Stack.Resources.%s.Properties.Items[0]' % key] = {'Name': 'override%d' % i, 'Value': i}
+    elif choice == 1:
+      variables['Stack.Resources.%s.Properties.Items[]' % key] = [{'Name': 'append%d' % i, 'Value': i}]
+    elif choice == 2:
+      variables["Stack.Resources.%s.Properties.Items[?Name=='item1']" % key] = {'Name': 'filter%d' % i, 'Value': i}
+    else:
+      variables['Stack.Resources.*.Properties.Override%d' % i] = i
+    variables['Stack.Resources.%s.Properties.Dotted%d' % (key, i)] = i
+    variables['Config.Setting%d.Value' % i] = i
+  for resource_type in RESOURCE_TYPES:
+    variables['%s.Properties.Global' % resource_type] = resource_type
+  return variables
+
+# Times fn over prepared arguments, returning per operation timings and peak memory
+def measure(fn, setup, repeat):
+  timings = []
+  for _ in range(repeat):
+    args = setup()
+    start = time.time()
+    fn(*args)
+    timings.append(time.time() - start)
+  peak = None
+  if tracemalloc:
+    args = setup()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  mean = sum(timings) / len(timings)
+  return {
+    'min': min(timings),
+    'mean': mean,
+    'ops_per_sec': 1 / mean if mean else float('inf'),
+    'peak_memory': peak
+  }
+
+# Returns benchmarks for a synthetic stack as (name, fn, setup) tuples
+def benchmarks(stack, variables):
+  globals_ = cfn_dotted_dict(variables, paths=['AWS::'])
+  return [
+    ('stack_transform', lambda data: stack_transform(data, template_paths=[TEMPLATE_PATH]),
+      lambda: (copy.deepcopy(stack),)),
+    ('search_and_replace', lambda data: search_and_replace(data, 'Param0', 'Param0Renamed'),
+      lambda: (copy.deepcopy(stack),)),
+    ('stack_overrides', stack_overrides,
+      lambda: (dict(variables, Stack=copy.deepcopy(stack)),)),
+    ('cfn_dotted_dict', lambda data: cfn_dotted_dict(data, paths=['Stack.', 'Config.', 'AWS::']),
+      lambda: (variables,)),
+    ('dict_override', dict_override,
+      lambda: (stack['Resources'], globals_))
+  ]
+
+# Returns the scaling exponent of time against size between consecutive sizes (1.0 is linear)
+def scaling(results, name, sizes):
+  exponents = []
+  for (a, b) in zip(sizes, sizes[1:]):
+    (ta, tb) = (results[a][name]['mean'], results[b][name]['mean'])
+    exponents.append(math.log(tb / ta) / math.log(b / a) if ta and tb else None)
+  return exponents
+
+def parse_sizes(value):
+  return [int(size) for size in value.split(',')]
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmarks the filter plugin transform pipeline against synthetic stacks')
+  parser.add_argument('-n', '--resources', type=parse_sizes, default=[50, 100, 200, 400],
+    help='comma separated number of resources per stack (default: 50,100,200,400)')
+  parser.add_argument('-m', '--transforms', type=int, default=None,
+    help='number of Stack::Transform resources per stack (default: 1 per 10 resources)')
+  parser.add_argument('-k', '--selectors', type=int, default=None,
+    help='number of override selectors (default: 1 per 5 resources)')
+  parser.add_argument('-t', '--templates', default=','.join(TEMPLATES),
+    help='comma separated transform templates to use from the role templates folder')
+  parser.add_argument('-r', '--repeat', type=int, default=5, help='number of timed runs per benchmark')
+  parser.add_argument('-s', '--seed', type=int, default=1, help='random seed for synthetic stacks')
+  parser.add_argument('--ansible-filters', action='store_true',
+    help='use Ansible filter plugins rather than local stand-ins for combine and other core filters')
+  parser.add_argument('--json', help='write results as JSON to this file')
+  args = parser.parse_args(argv)
+
+  if not args.ansible_filters:
+    filters = local_filters()
+    stack_transforms.ansible_filters = lambda filter_paths: filters
+  templates = args.templates.split(',')
+  sizes = sorted(set(args.resources))
+  results = {}
+  print("%-20s %9s %6s %6s %12s %12s %12s %12s" % ('benchmark', 'resources', 'trans', 'sel', 'min (ms)', 'mean (ms)', 'ops/sec', 'peak (KiB)'))
+  for size in sizes:
+    transforms = args.transforms if args.transforms is not None else max(size // 10, 1)
+    selectors = args.selectors if args.selectors is not None else max(size // 5, 1)
+    stack = synthetic_stack(size, transforms, templates, args.seed)
+    variables = synthetic_vars(stack, selectors, args.seed)
+    results[size] = {}
+    for (name, fn, setup) in benchmarks(stack, variables):
+      result = dict(measure(fn, setup, args.repeat), transforms=transforms, selectors=selectors)
+      results[size][name] = result
+      print("%-20s %9d %6d %6d %12.2f %12.2f %12.1f %12s" % (
+        name, size, transforms, selectors, result['min'] * 1000, result['mean'] * 1000, result['ops_per_sec'],
+        '%.1f' % (result['peak_memory'] / 1024) if result['peak_memory'] is not None else '-'
+      ))
+
+  report = {'sizes': sizes, 'results': results, 'scaling': {}}
+  if len(sizes) > 1:
+    print("\nScaling exponent of mean time against resources (1.0 = linear)")
+    for (name, _, _) in benchmarks(stack, variables):
+      report['scaling'][name] = scaling(results, name, sizes)
+      print("%-20s %s" % (name, ' '.join('%6.2f' % e if e is not None else '     -' for e in report['scaling'][name])))
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
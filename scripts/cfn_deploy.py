@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+''' Deploys generated CloudFormation stack artifacts for one or more stacks concurrently using change sets '''
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import threading
+
+ROLE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROLE_PATH, 'module_utils'))
+
+from stack_deploy import HAS_BOTO3, aws_client, collect_stack_facts, deploy_stacks
+from stack_graph import StackGraphError, stack_plan
+
+CONFIG_SUFFIX = '-config.json'
+TEMPLATE_SUFFIX = '-stack.yml'
+PRINT_LOCK = threading.Lock()
+
+# Returns deploy arguments for a generated stack template and the stack config file alongside it
+def load_stack(stack_name, template, **kwargs):
+  config_file = template[:-len(TEMPLATE_SUFFIX)] + CONFIG_SUFFIX if template.endswith(TEMPLATE_SUFFIX) else None
+  config = {}
+  if config_file and os.path.exists(config_file):
+    with open(config_file) as f:
+      config = json.load(f)
+  with open(template) as f:
+    template_body = f.read()
+  return dict(
+    kwargs,
+    stack_name=stack_name,
+    template_body=template_body,
+    parameters=config.get('Parameters') or {}
+  )
+
+def log_event(event):
+  with PRINT_LOCK:
+    print("%s: %s %s %s %s" % (
+      event['StackName'], event['Timestamp'].strftime('%H:%M:%S'), event['LogicalResourceId'],
+      event['ResourceStatus'], event.get('ResourceStatusReason') or ''
+    ))
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Deploys generated CloudFormation stacks concurrently using change sets')
+  parser.add_argument('stacks', nargs='+', metavar='NAME=TEMPLATE',
+    help="stack name and generated template, e.g. my-stack=build/20180705154440/dev-my-stack-stack.yml. Parameters are read from the '-config.json' file alongside the template")
+  parser.add_argument('-j', '--jobs', type=int, default=4, help='maximum number of stacks to deploy concurrently')
+  parser.add_argument('--region', help='AWS region')
+  parser.add_argument('--profile', help='AWS credentials profile')
+  parser.add_argument('--endpoint-url', help='CloudFormation and S3 endpoint URL, e.g. a local CloudFormation stand-in')
+  parser.add_argument('--role-arn', help='ARN of the IAM role CloudFormation assumes to deploy each stack')
+  parser.add_argument('--s3-bucket', help='S3 bucket to upload templates to')
+  parser.add_argument('--s3-prefix', default='', help='S3 key prefix of uploaded templates')
+  parser.add_argument('--disable-rollback', action='store_true', help='disable rollback of stacks on failure')
+  parser.add_argument('--timeout', type=int, default=3600, help='maximum time in seconds to wait for each stack')
+  parser.add_argument('--facts', help='write stack facts for each stack as JSON to this file')
+  parser.add_argument('--facts-cache', help='folder of cached stack resources used to collect stack facts')
+  parser.add_argument('-w', '--waves', action='store_true',
+    help='deploy stacks in waves ordered by their exports and Fn::ImportValue references, stopping after a wave with a failed stack')
+  args = parser.parse_args(argv)
+  if not HAS_BOTO3:
+    parser.error('boto3 is required')
+
+  stacks = [
+    load_stack(
+      name, template,
+      role_arn=args.role_arn,
+      s3_bucket=args.s3_bucket,
+      s3_prefix='/'.join(p for p in [args.s3_prefix.strip('/'), name] if p),
+      disable_rollback=args.disable_rollback,
+      timeout=args.timeout
+    )
+    for stack in args.stacks
+    for (name, template) in [stack.split('=', 1)]
+  ]
+  waves = [stacks]
+  if args.waves:
+    templates = dict((stack.split('=', 1) for stack in args.stacks))
+    try:
+      plan = stack_plan(templates, args.region)
+    except StackGraphError as e:
+      parser.exit(1, "ERROR: %s\n" % e)
+    by_name = dict((stack['stack_name'], stack) for stack in stacks)
+    waves = [[by_name[name] for name in wave] for wave in plan['waves']]
+  results = []
+  for index, wave in enumerate(waves):
+    if any(result.get('failed') for result in results):
+      results += [{'stack_name': s['stack_name'], 'failed': True, 'msg': 'skipped due to failures in an earlier wave'} for s in wave]
+      continue
+    if args.waves:
+      with PRINT_LOCK:
+        print("wave %d: %s" % (index + 1, ' '.join(s['stack_name'] for s in wave)))
+    results += deploy_stacks(
+      wave, jobs=args.jobs, region=args.region, profile=args.profile, endpoint_url=args.endpoint_url, log=log_event
+    )
+  for result in results:
+    if result.get('failed'):
+      print("%s: FAILED %s" % (result['stack_name'], result['msg']), file=sys.stderr)
+    else:
+      print("%s: %s" % (result['stack_name'], result['stack_status'] if result['changed'] else 'NO CHANGES'))
+  if args.facts:
+    cfn = aws_client('cloudformation', args.region, args.profile, args.endpoint_url)
+    facts = collect_stack_facts(cfn, [r['stack_name'] for r in results], args.facts_cache)[0]
+    with open(args.facts, 'w') as f:
+      json.dump(facts, f, indent=2, sort_keys=True)
+  return 1 if any(result.get('failed') for result in results) else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
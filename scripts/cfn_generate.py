@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+''' Generates CloudFormation stack artifacts for one or more stacks in parallel, using the same pipeline as tasks/generator.yml '''
+from __future__ import print_function
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from jinja2.exceptions import UndefinedError
+import argparse
+import ast
+import copy
+import glob
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+import yaml
+
+try:
+  basestring
+except NameError:
+  basestring = str
+
+ROLE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROLE_PATH, 'filter_plugins'))
+
+from cfn_dotted_dict import cfn_dotted_dicts
+from dict_override import dict_override
+from stack_inputs import stack_inputs
+from stack_overrides import stack_overrides
+from compact import compact
+from stack_fingerprint import content_digest
+from stack_optimize import stack_optimize
+from stack_validate import stack_validate
+from stack_transforms import SafeLoader, ansible_filters, property_transform, stack_merge, stack_output, stack_transform, to_stack_yaml
+
+JINJA2_OVERRIDE = '#jinja2:'
+SINGLE_EXPRESSION = re.compile(r'^\s*{{([^{}]*)}}\s*$')
+TEMPLATE_SIZE_LIMIT = 51200
+
+# Converts a variable to a boolean, as per the Ansible bool filter
+def to_bool(value):
+  return value is True or str(value).lower() in ['1', 'on', 'true', 'y', 'yes']
+
+# Loads a variables file, or each variables file in a directory in sorted order (as per Ansible group_vars)
+def load_vars(path):
+  if os.path.isdir(path):
+    files = sorted(
+      f for pattern in ['*.yml', '*.yaml', '*.json']
+      for f in glob.glob(os.path.join(path, pattern))
+    )
+  else:
+    files = [path]
+  variables = {}
+  for file in files:
+    with open(file) as f:
+      variables.update(yaml.safe_load(f) or {})
+  return variables
+
+# Returns a Jinja environment configured with the same defaults as the Ansible template module
+def template_environment(filters, searchpath=[]):
+  environment = Environment(
+    loader=FileSystemLoader(searchpath),
+    undefined=StrictUndefined,
+    trim_blocks=True,
+    keep_trailing_newline=True
+  )
+  environment.filters = filters
+  return environment
+
+# Templates a variable value, preserving native types for values that are a single expression
+def template_value(environment, value, variables):
+  if type(value) is dict:
+    return {k: template_value(environment, v, variables) for k, v in value.items()}
+  if type(value) is list:
+    return [template_value(environment, v, variables) for v in value]
+  if not isinstance(value, basestring) or ('{{' not in value and '{%' not in value):
+    return value
+  expression = SINGLE_EXPRESSION.match(value)
+  if expression:
+    return environment.compile_expression(expression.group(1), undefined_to_none=False)(**variables)
+  return environment.from_string(value).render(variables)
+
+# Resolves templated variables, deferring variables that reference variables that are not yet resolved
+def resolve_vars(environment, variables, passes=10):
+  resolved = dict(variables)
+  for _ in range(passes):
+    changed = False
+    for key, value in resolved.items():
+      try:
+        templated = template_value(environment, value, resolved)
+      except UndefinedError:
+        continue
+      if templated != value:
+        resolved[key] = templated
+        changed = True
+    if not changed:
+      break
+  return resolved
+
+# Renders a stack template file, honouring '#jinja2:' environment overrides in the first line as per Ansible
+def render_file(environment, template_file, variables):
+  with open(template_file) as f:
+    data = f.read()
+  if data.startswith(JINJA2_OVERRIDE):
+    eol = data.find('\n')
+    line = data[len(JINJA2_OVERRIDE):eol]
+    data = data[eol + 1:]
+    environment = environment.overlay()
+    for pair in line.split(','):
+      (key, value) = pair.split(':')
+      setattr(environment, key.strip(), ast.literal_eval(value.strip()))
+  return environment.from_string(data).render(variables)
+
+# Locates a stack template relative to the role and playbook, as per the Ansible template module search path
+def lookup_stack_template(template, role_path, playbook_dir):
+  template_file = next((
+    os.path.abspath(path)
+    for base in [os.path.join(role_path, 'templates'), role_path, os.path.join(playbook_dir, 'templates'), playbook_dir]
+    for path in [os.path.join(base, template)]
+    if os.path.exists(path)
+  ), None)
+  if not template_file:
+    raise IOError("Could not locate stack template %s" % template)
+  return template_file
+
+# Generates stack template, policy and config artifacts for an environment's variables
+def generate_stack(env, hostvars, role_path=ROLE_PATH, playbook_dir=None, extra_vars={}, build_folder=None,
+                   timestamp=None, cache_path=None, debug=False):
+  playbook_dir = os.path.abspath(playbook_dir or os.getcwd())
+  timestamp = timestamp or time.strftime('%Y%m%d%H%M%S')
+  filter_paths = [os.path.join(role_path, 'filter_plugins')]
+  template_paths = [os.path.join(role_path, 'templates')]
+  filters = ansible_filters([os.path.join(playbook_dir, 'filter_plugins')] + filter_paths)
+  combine = filters['combine']
+  environment = template_environment(filters)
+
+  # Variable precedence - role defaults, inventory variables, role variables, extra variables
+  host = dict(hostvars, **extra_vars)
+  host['env'] = env
+  host = resolve_vars(environment, host)
+  variables = dict(load_vars(os.path.join(role_path, 'defaults', 'main.yml')))
+  variables.update(host)
+  variables.update(load_vars(os.path.join(role_path, 'vars', 'main.yml')))
+  variables.update(extra_vars)
+  variables.update({'env': env, 'role_path': role_path, 'playbook_dir': playbook_dir, 'hostvars': {env: host}})
+  variables = resolve_vars(environment, variables)
+
+  # Create stack variables and facts (tasks/init.yml)
+  stack = variables.get('Stack') or {}
+  (dotted_stack, dotted_config, cf_stack_globals) = cfn_dotted_dicts(host, paths=['Stack.', 'Config.', 'AWS::'])
+  Stack = combine(stack, dotted_stack.get('Stack') or {}, recursive=True)
+  Config = combine(stack, dotted_config.get('Config') or {}, recursive=True)
+  cf_stack_name = Stack['Name']
+  cf_stack_policy = Stack.get('Policy') or variables['cf_default_stack_policy']
+  cf_stack_tags = Stack.get('Tags') or {}
+  cf_build_folder = build_folder or Stack.get('BuildFolder') or os.path.join(Stack.get('Path') or './build', timestamp)
+  cf_stack_template_yaml = "%s/%s-%s-stack.yml" % (cf_build_folder, env, cf_stack_name)
+  cf_stack_policy_json = "%s/%s-%s-policy.json" % (cf_build_folder, env, cf_stack_name)
+  cf_stack_config_json = "%s/%s-%s-config.json" % (cf_build_folder, env, cf_stack_name)
+  cf_stack_transform_json = "%s/%s-%s-transform.json" % (cf_build_folder, env, cf_stack_name)
+  cf_transform_report = to_bool(Stack.get('TransformReport', debug))
+  if not os.path.isdir(cf_build_folder):
+    os.makedirs(cf_build_folder)
+  variables.update({
+    'Stack': Stack,
+    'Config': Config,
+    'cf_stack_name': cf_stack_name,
+    'cf_stack_policy': cf_stack_policy,
+    'cf_stack_tags': cf_stack_tags,
+    'cf_stack_globals': cf_stack_globals,
+    'cf_build_folder': cf_build_folder,
+    'current_timestamp': timestamp,
+    'debug': debug
+  })
+
+  # Generate template and apply transforms and overrides (tasks/generator.yml)
+  template_file = lookup_stack_template(Stack.get('Template') or './templates/stack.yml.j2', role_path, playbook_dir)
+  environment.loader = FileSystemLoader([
+    os.path.dirname(template_file),
+    os.path.join(role_path, 'templates'),
+    role_path,
+    os.path.join(playbook_dir, 'templates'),
+    playbook_dir
+  ])
+  cf_stack_template_vars = yaml.load(render_file(environment, template_file, variables), Loader=SafeLoader)
+  Stack = stack_merge(cf_stack_template_vars, Stack)
+  Stack = stack_transform(Stack, debug=debug, template_paths=template_paths, filter_paths=filter_paths, cache_path=cache_path,
+                          report_path=cf_stack_transform_json if cf_transform_report else None)
+  Stack = stack_merge(Stack, {'Resources': dict_override(Stack['Resources'], cf_stack_globals)})
+  Stack = stack_merge(Stack, stack_overrides(dict(host, Stack=copy.deepcopy(Stack))))
+  Stack = property_transform(Stack, filter_paths=filter_paths)
+  if to_bool(Stack.get('Validate', True)):
+    stack_validate(stack_output(Stack))
+  cf_stack_template_body = compact(stack_output(Stack)) if to_bool(Stack.get('Compact')) else to_stack_yaml(stack_output(Stack), indent=2)
+  cf_stack_template_digest = content_digest(cf_stack_template_body)
+  cf_stack_template_saved = 0
+  optimize = Stack.get('Optimize', 'auto')
+  if cf_stack_template_digest['size'] > TEMPLATE_SIZE_LIMIT if str(optimize) == 'auto' else to_bool(optimize):
+    cf_stack_template_body = compact(stack_optimize(stack_output(Stack), hoist=to_bool(Stack.get('OptimizeHoist', True))))
+    cf_stack_template_saved = cf_stack_template_digest['size'] - len(cf_stack_template_body.encode('utf-8'))
+    cf_stack_template_digest = content_digest(cf_stack_template_body)
+  with open(cf_stack_template_yaml, 'w') as f:
+    f.write(cf_stack_template_body)
+  with open(cf_stack_policy_json, 'w') as f:
+    f.write(filters['to_json'](cf_stack_policy))
+  cf_stack_inputs = variables.get('cf_stack_inputs') or stack_inputs(Stack.get('Parameters') or {}, Stack.get('Inputs') or {})
+  cf_stack_config = {
+    'Parameters': cf_stack_inputs,
+    'StackPolicy': cf_stack_policy,
+    'Tags': cf_stack_tags
+  }
+  with open(cf_stack_config_json, 'w') as f:
+    f.write(filters['to_json'](cf_stack_config))
+  return {
+    'env': env,
+    'cf_stack_name': cf_stack_name,
+    'cf_build_folder': cf_build_folder,
+    'cf_stack_template_yaml': cf_stack_template_yaml,
+    'cf_stack_policy_json': cf_stack_policy_json,
+    'cf_stack_config_json': cf_stack_config_json,
+    'cf_stack_transform_json': cf_stack_transform_json if cf_transform_report else None,
+    'cf_stack_template_digest': cf_stack_template_digest,
+    'cf_stack_template_saved': cf_stack_template_saved,
+    'cf_upload_s3': to_bool(Stack.get('Upload')) or cf_stack_template_digest['size'] > TEMPLATE_SIZE_LIMIT
+  }
+
+# Pool worker - generates a single stack in the stack's playbook folder, returning any failure as a result
+# The working directory is restored afterwards, as sequential generation runs the worker in the calling process
+def generate_worker(config):
+  cwd = os.getcwd()
+  try:
+    os.chdir(config.get('playbook_dir') or cwd)
+    return generate_stack(**config)
+  except Exception as e:
+    return {'env': config['env'], 'failed': True, 'msg': "%s: %s" % (type(e).__name__, e), 'trace': traceback.format_exc()}
+  finally:
+    os.chdir(cwd)
+
+# Generates multiple stacks using a pool of processes
+def generate_stacks(configs, processes=None):
+  if processes == 1 or len(configs) <= 1:
+    return [generate_worker(config) for config in configs]
+  pool = multiprocessing.Pool(processes=processes)
+  try:
+    return pool.map(generate_worker, configs, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+# Parses an extra variables argument - either key=value pairs, JSON/YAML, or @file
+def parse_extra_vars(value):
+  if value.startswith('@'):
+    return load_vars(value[1:])
+  if value.lstrip().startswith('{'):
+    return yaml.safe_load(value)
+  return dict(pair.split('=', 1) for pair in value.split())
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Generates CloudFormation stack artifacts for one or more environments in parallel')
+  parser.add_argument('stacks', nargs='+', metavar='[ENV=]VARS',
+    help='environment variables file or group_vars folder, optionally prefixed with the environment name (defaults to the file or folder name)')
+  parser.add_argument('-d', '--playbook-dir', default=os.getcwd(), help='playbook folder containing stack templates (default: current folder)')
+  parser.add_argument('-e', '--extra-vars', action='append', default=[], help='extra variables as key=value, JSON/YAML or @file')
+  parser.add_argument('-b', '--build-folder', help='build folder for generated artifacts (default: Stack.BuildFolder or ./build/<timestamp>)')
+  parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help='number of stacks to generate in parallel')
+  parser.add_argument('--cache-path', help='template bytecode cache folder')
+  parser.add_argument('--debug', action='store_true', help='enable stack transform debug logging')
+  args = parser.parse_args(argv)
+
+  extra_vars = {}
+  for value in args.extra_vars:
+    extra_vars.update(parse_extra_vars(value))
+  timestamp = time.strftime('%Y%m%d%H%M%S')
+  configs = []
+  for stack in args.stacks:
+    env, path = stack.split('=', 1) if '=' in stack else (os.path.splitext(os.path.basename(stack.rstrip('/')))[0], stack)
+    configs.append({
+      'env': env,
+      'hostvars': load_vars(path),
+      'playbook_dir': os.path.abspath(args.playbook_dir),
+      'extra_vars': extra_vars,
+      'build_folder': args.build_folder,
+      'timestamp': timestamp,
+      'cache_path': args.cache_path,
+      'debug': args.debug
+    })
+
+  results = generate_stacks(configs, processes=args.jobs)
+  for result in results:
+    if result.get('failed'):
+      print("%s: FAILED %s" % (result['env'], result['msg']), file=sys.stderr)
+      logging.debug(result['trace'])
+    else:
+      print("%s: %s %s%s" % (
+        result['env'], result['cf_stack_name'], result['cf_stack_template_yaml'],
+        ' (optimized, %d bytes saved)' % result['cf_stack_template_saved'] if result['cf_stack_template_saved'] else ''
+      ))
+  return 1 if any(result.get('failed') for result in results) else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+''' Plans the deployment order of generated CloudFormation stacks as waves of stacks that can be deployed in parallel '''
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+
+ROLE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROLE_PATH, 'module_utils'))
+
+from stack_graph import StackGraphError, find_stacks, stack_plan
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Plans the deployment order of generated CloudFormation stacks from their exports and imports')
+  parser.add_argument('paths', nargs='+', metavar='PATH',
+    help='build folder or generated stack template.  Later build folders take precedence for the same stack')
+  parser.add_argument('-e', '--env', help='only plan stacks of this environment, and remove the environment prefix from stack names')
+  parser.add_argument('--region', help='AWS region used to resolve AWS::Region in export and import names')
+  parser.add_argument('--json', help='write the plan as JSON to this file')
+  parser.add_argument('-v', '--verbose', action='store_true', help='print the exports, imports and dependencies of each stack')
+  args = parser.parse_args(argv)
+
+  stacks = find_stacks(args.paths, args.env)
+  if not stacks:
+    parser.error('no stack templates found')
+  try:
+    plan = stack_plan(stacks, args.region)
+  except StackGraphError as e:
+    print("ERROR: %s" % e, file=sys.stderr)
+    return 1
+  for name, stack in sorted(plan['stacks'].items()):
+    for reference in stack['unresolved']:
+      print("WARNING: %s: unresolved %s" % (name, reference), file=sys.stderr)
+    if args.verbose:
+      print("%s: exports %s" % (name, ', '.join(stack['exports']) or '-'))
+      print("%s: depends on %s" % (name, ', '.join(stack['dependencies']) or '-'))
+      print("%s: imports existing %s" % (name, ', '.join(stack['external']) or '-'))
+  for index, wave in enumerate(plan['waves']):
+    print("wave %d: %s" % (index + 1, ' '.join('%s=%s' % (name, stacks[name]) for name in wave)))
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(plan, f, indent=2, sort_keys=True)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROLE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Filter plugins, module utils and scripts are imported as top level modules, as per scripts/cfn_generate.py
+for folder in ['filter_plugins', 'module_utils', 'scripts']:
+  sys.path.insert(0, os.path.join(ROLE_PATH, folder))
@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip('ansible')
+from ansible.errors import AnsibleError
+from cfn_dotted_dict import cfn_dotted_dict, cfn_dotted_dicts
+
+# Host variables that fail when a variable that does not match a path is looked up, as Ansible templates each
+# host variable on lookup
+class HostVars(dict):
+  def __init__(self, data, paths):
+    dict.__init__(self, data)
+    self.paths = tuple(paths)
+
+  def __getitem__(self, key):
+    assert key.startswith(self.paths), 'looked up %s' % key
+    return dict.__getitem__(self, key)
+
+VARIABLES = {
+  'Stack.Name': 'app',
+  'Stack.Resources.Topic': {'Type': 'AWS::SNS::Topic', 'Properties': {'TopicName': 'topic'}},
+  'Stack.Resources.Topic.Properties.DisplayName': 'Topic',
+  'Stack.Resources.Queue.Properties.Tags[]': [{'Key': 'Name', 'Value': 'queue'}],
+  'Config.Vpc.Cidr': '10.0.0.0/16',
+  'AWS::SNS::Topic.Properties.KmsMasterKeyId': 'alias/aws/sns',
+  'config_topic': '{{ undefined_variable }}'
+}
+
+def test_builds_a_tree_per_path():
+  variables = HostVars(VARIABLES, ['Stack.', 'Config.', 'AWS::'])
+  stack, config, resource_globals = cfn_dotted_dicts(variables, paths=['Stack.', 'Config.', 'AWS::'])
+  assert stack == {'Stack': {
+    'Name': 'app',
+    'Resources': {
+      'Topic': {'Type': 'AWS::SNS::Topic', 'Properties': {'TopicName': 'topic', 'DisplayName': 'Topic'}}
+    }
+  }}
+  assert config == {'Config': {'Vpc': {'Cidr': '10.0.0.0/16'}}}
+  assert resource_globals == {'AWS::SNS::Topic': {'Properties': {'KmsMasterKeyId': 'alias/aws/sns'}}}
+  assert 'DisplayName' not in VARIABLES['Stack.Resources.Topic']['Properties']
+
+def test_builds_a_single_tree_for_many_paths():
+  variables = HostVars(VARIABLES, ['Stack.Name', 'Config.'])
+  assert cfn_dotted_dict(variables, paths=['Stack.Name', 'Config.']) == {
+    'Stack': {'Name': 'app'},
+    'Config': {'Vpc': {'Cidr': '10.0.0.0/16'}}
+  }
+
+def test_reports_conflicting_dotted_keys():
+  variables = {
+    'Stack.Resources.Topic': 'topic',
+    'Stack.Resources.Topic.Type': 'AWS::SNS::Topic',
+    'Stack.Resources.Topic.Properties.TopicName': 'topic',
+    'Stack.Name': 'app'
+  }
+  with pytest.raises(AnsibleError) as e:
+    cfn_dotted_dicts(variables, paths=['Stack.'])
+  assert str(e.value) == (
+    'Conflicting dotted variable assignments: '
+    'Stack.Resources.Topic (str) and Stack.Resources.Topic.Properties, '
+    'Stack.Resources.Topic (str) and Stack.Resources.Topic.Type'
+  )
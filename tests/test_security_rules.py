@@ -0,0 +1,90 @@
+import random
+import pytest
+
+netaddr = pytest.importorskip('netaddr')
+from ansible.errors import AnsibleFilterError
+from security_rules import merge_cidrs, merge_ranges, security_rules
+
+IMPORTED_CIDR = {'Fn::ImportValue': 'ManagementSubnetCidr'}
+
+def rule(protocol, from_port, to_port, cidr_ip):
+  return {'IpProtocol': protocol, 'FromPort': from_port, 'ToPort': to_port, 'CidrIp': cidr_ip}
+
+# Returns the (protocol, port, address) tuples allowed by security group rules
+def coverage(rules):
+  return set(
+    (str(r['IpProtocol']), port, int(address))
+    for r in rules
+    for port in range(int(r['FromPort']), int(r['ToPort']) + 1)
+    for address in netaddr.IPNetwork(r['CidrIp'])
+  )
+
+def test_merge_ranges_merges_overlapping_and_adjacent_ranges():
+  assert merge_ranges([(443, 443), (80, 80), (81, 90), (85, 88), (8080, 8081)]) == [(80, 90), (443, 443), (8080, 8081)]
+
+def test_merge_cidrs_aggregates_literals_and_deduplicates_functions():
+  cidrs = ['10.0.1.0/24', '10.0.0.0/24', '10.0.0.128/25', IMPORTED_CIDR, dict(IMPORTED_CIDR)]
+  assert merge_cidrs(cidrs) == ['10.0.0.0/23', IMPORTED_CIDR]
+
+def test_expands_rules_without_compaction():
+  rules = security_rules([{'Ports': [443, 'udp/53'], 'CidrIp': ['10.0.0.0/24', '10.0.1.0/24']}])
+  assert rules == [
+    rule('tcp', 443, 443, '10.0.0.0/24'), rule('udp', 53, 53, '10.0.0.0/24'),
+    rule('tcp', 443, 443, '10.0.1.0/24'), rule('udp', 53, 53, '10.0.1.0/24')
+  ]
+
+def test_compacts_port_ranges_and_cidrs():
+  report = {}
+  rules = security_rules([
+    {'Ports': [80, 'tcp/81-90', 443], 'CidrIp': ['10.0.0.0/25', '10.0.0.128/25']},
+    {'Ports': ['icmp/8', 'icmp/0'], 'CidrIp': ['10.0.0.0/24', IMPORTED_CIDR, IMPORTED_CIDR]}
+  ], compact=True, report=report)
+  assert rules == [
+    rule('tcp', 80, 90, '10.0.0.0/24'), rule('tcp', 443, 443, '10.0.0.0/24'),
+    rule('icmp', 0, 0, '10.0.0.0/24'), rule('icmp', 0, 0, IMPORTED_CIDR),
+    rule('icmp', 8, 8, '10.0.0.0/24'), rule('icmp', 8, 8, IMPORTED_CIDR)
+  ]
+  assert report == {'Rules': 12, 'Compacted': 6, 'Saved': 6}
+
+def test_compacts_port_ranges_without_protocol_as_tcp():
+  rules = security_rules([{'Ports': ['82-90', 80, '81', 'TCP/91'], 'CidrIp': ['10.0.0.0/24']}], compact=True)
+  assert rules == [rule('tcp', 80, 91, '10.0.0.0/24')]
+
+def test_compacts_all_protocols():
+  rules = security_rules([{'Ports': ['-1', 443], 'CidrIp': ['10.0.0.0/25', '10.0.0.128/25']}], compact=True)
+  assert rules == [rule('-1', -1, -1, '10.0.0.0/24'), rule('tcp', 443, 443, '10.0.0.0/24')]
+
+@pytest.mark.parametrize('cidr_ip', ['10.0.0.0/33', '10.0.0.300/24', 'any'])
+def test_compaction_reports_invalid_cidrs_with_their_rule(cidr_ip):
+  with pytest.raises(AnsibleFilterError) as e:
+    security_rules([
+      {'Ports': [443], 'CidrIp': ['10.0.0.0/24', IMPORTED_CIDR]},
+      {'Ports': [80], 'CidrIp': ['10.0.1.0/24', cidr_ip]}
+    ], compact=True)
+  assert str(e.value).startswith('Invalid CIDR %s in security rule {"CidrIp": ["10.0.1.0/24", "%s"], "Ports": [80]}' % (cidr_ip, cidr_ip))
+
+def test_does_not_merge_icmp_types():
+  rules = security_rules([{'Ports': ['icmp/3', 'icmp/4'], 'CidrIp': ['10.0.0.0/24']}], compact=True)
+  assert rules == [rule('icmp', 3, 3, '10.0.0.0/24'), rule('icmp', 4, 4, '10.0.0.0/24')]
+
+def test_compacted_rules_allow_the_same_traffic():
+  generator = random.Random(7)
+  subnets = list(netaddr.IPNetwork('10.0.0.0/26').subnet(29))
+  for _ in range(50):
+    rules = [
+      {
+        'Ports': [
+          generator.choice(['tcp/%d-%d', 'udp/%d-%d', '%d-%d']) % tuple(sorted([generator.randint(1, 12), generator.randint(1, 12)]))
+          for _ in range(generator.randint(1, 4))
+        ] + [generator.randint(1, 12) for _ in range(generator.randint(0, 2))],
+        'CidrIp': [str(subnet) for subnet in generator.sample(subnets, generator.randint(1, 5))]
+      }
+      for _ in range(generator.randint(1, 4))
+    ]
+    compacted = security_rules(rules, compact=True)
+    expanded = [
+      dict(r, IpProtocol='tcp') if '/' not in str(port_expr) else r
+      for r, port_expr in zip(security_rules(rules), [p for r in rules for c in r['CidrIp'] for p in r['Ports']])
+    ]
+    assert coverage(compacted) == coverage(expanded)
+    assert len(compacted) <= len(expanded)
@@ -0,0 +1,185 @@
+import datetime
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+
+import stack_deploy
+from stack_deploy import Backoff, DeployError, collect_stack_facts, deploy_stack, stack_parameters, upload_template
+from stack_fingerprint import content_digest
+
+NOW = datetime.datetime(2019, 1, 1, 12, 0, 0)
+STACK_ID = 'arn:aws:cloudformation:us-east-1:123456789012:stack/app/1'
+CHANGE_SET_ID = 'arn:aws:cloudformation:us-east-1:123456789012:changeSet/deploy/1'
+TEMPLATE = 'Parameters:\n  Env:\n    Type: String\n  Size:\n    Type: String\nResources: {}\n'
+
+def client(service):
+  return boto3.client(service, region_name='us-east-1', aws_access_key_id='x', aws_secret_access_key='x')
+
+def stack(status, parameters=None):
+  return {'StackId': STACK_ID, 'StackName': 'app', 'CreationTime': NOW, 'StackStatus': status, 'Parameters': parameters or []}
+
+def stack_event(event_id, status, resource_type='AWS::CloudFormation::Stack', logical_id='app', reason=None):
+  event = {
+    'StackId': STACK_ID, 'EventId': event_id, 'StackName': 'app', 'LogicalResourceId': logical_id,
+    'PhysicalResourceId': STACK_ID if resource_type == 'AWS::CloudFormation::Stack' else logical_id,
+    'ResourceType': resource_type, 'Timestamp': NOW + datetime.timedelta(seconds=1), 'ResourceStatus': status
+  }
+  if reason:
+    event['ResourceStatusReason'] = reason
+  return event
+
+def not_found(stubber):
+  stubber.add_client_error('describe_stacks', service_message='Stack with id app does not exist')
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+  delays = []
+  monkeypatch.setattr(stack_deploy.time, 'sleep', delays.append)
+  return delays
+
+def test_backoff_increases_until_progress():
+  backoff = Backoff(minimum=2, maximum=10, factor=2)
+  delays = []
+  for progress in [False, False, False, False, True]:
+    backoff.wait(progress)
+    delays.append(backoff.delay)
+  assert delays == [4, 8, 10, 10, 2]
+
+def test_stack_parameters_only_passes_declared_parameters():
+  parameters = stack_parameters(TEMPLATE, {'Env': 'dev', 'Size': [1, 2], 'Unused': 'x'})
+  assert parameters == [
+    {'ParameterKey': 'Env', 'ParameterValue': 'dev'},
+    {'ParameterKey': 'Size', 'ParameterValue': '1,2'}
+  ]
+
+def test_stack_parameters_keeps_previous_values():
+  previous = stack('UPDATE_COMPLETE', [{'ParameterKey': 'Size', 'ParameterValue': '1'}])
+  assert stack_parameters(TEMPLATE, {'Env': 'dev'}, previous) == [
+    {'ParameterKey': 'Env', 'ParameterValue': 'dev'},
+    {'ParameterKey': 'Size', 'UsePreviousValue': True}
+  ]
+
+def test_deploy_stack_creates_stack_using_change_set():
+  cfn = client('cloudformation')
+  with Stubber(cfn) as stubber:
+    not_found(stubber)
+    stubber.add_response('create_change_set', {'Id': CHANGE_SET_ID, 'StackId': STACK_ID}, {
+      'StackName': 'app', 'ChangeSetName': ANY, 'ChangeSetType': 'CREATE', 'TemplateBody': TEMPLATE,
+      'Parameters': [{'ParameterKey': 'Env', 'ParameterValue': 'dev'}], 'Capabilities': ANY,
+      'Tags': [{'Key': 'Owner', 'Value': 'ops'}]
+    })
+    stubber.add_response('describe_change_set', {'ChangeSetId': CHANGE_SET_ID, 'StackId': STACK_ID, 'Status': 'CREATE_IN_PROGRESS', 'CreationTime': NOW})
+    stubber.add_response('describe_change_set', {
+      'ChangeSetId': CHANGE_SET_ID, 'StackId': STACK_ID, 'Status': 'CREATE_COMPLETE', 'CreationTime': NOW,
+      'Changes': [{'Type': 'Resource', 'ResourceChange': {'Action': 'Add', 'LogicalResourceId': 'Topic'}}]
+    })
+    stubber.add_response('execute_change_set', {}, {'ChangeSetName': CHANGE_SET_ID})
+    stubber.add_response('describe_stack_events', {'StackEvents': [
+      stack_event('2', 'CREATE_COMPLETE'),
+      stack_event('1', 'CREATE_COMPLETE', 'AWS::SNS::Topic', 'Topic')
+    ]})
+    stubber.add_response('describe_stacks', {'Stacks': [stack('CREATE_COMPLETE')]})
+    result = deploy_stack(cfn, 'app', TEMPLATE, parameters={'Env': 'dev'}, tags={'Owner': 'ops'})
+    stubber.assert_no_pending_responses()
+  assert result['changed'] is True
+  assert result['change_set_type'] == 'CREATE'
+  assert result['stack_status'] == 'CREATE_COMPLETE'
+  assert result['changes'] == [{'action': 'Add', 'logical_resource_id': 'Topic'}]
+  assert [e['EventId'] for e in result['events']] == ['1', '2']
+
+def test_deploy_stack_without_changes_is_unchanged():
+  cfn = client('cloudformation')
+  with Stubber(cfn) as stubber:
+    stubber.add_response('describe_stacks', {'Stacks': [stack('UPDATE_COMPLETE')]})
+    stubber.add_client_error('create_change_set', service_message='No updates are to be performed.')
+    result = deploy_stack(cfn, 'app', TEMPLATE)
+  assert result['changed'] is False
+  assert result['stack_status'] == 'UPDATE_COMPLETE'
+
+def test_deploy_stack_reports_failed_resources():
+  cfn = client('cloudformation')
+  with Stubber(cfn) as stubber:
+    stubber.add_response('describe_stacks', {'Stacks': [stack('UPDATE_COMPLETE')]})
+    stubber.add_response('create_change_set', {'Id': CHANGE_SET_ID, 'StackId': STACK_ID})
+    stubber.add_response('describe_change_set', {'ChangeSetId': CHANGE_SET_ID, 'StackId': STACK_ID, 'Status': 'CREATE_COMPLETE', 'CreationTime': NOW})
+    stubber.add_response('execute_change_set', {})
+    stubber.add_response('describe_stack_events', {'StackEvents': [
+      stack_event('2', 'UPDATE_ROLLBACK_COMPLETE'),
+      stack_event('1', 'UPDATE_FAILED', 'AWS::SNS::Topic', 'Topic', 'Invalid parameter')
+    ]})
+    stubber.add_response('describe_stacks', {'Stacks': [stack('UPDATE_ROLLBACK_COMPLETE')]})
+    with pytest.raises(DeployError) as e:
+      deploy_stack(cfn, 'app', TEMPLATE)
+  assert 'UPDATE_ROLLBACK_COMPLETE' in str(e.value)
+  assert 'Topic UPDATE_FAILED: Invalid parameter' in str(e.value)
+  assert e.value.result['change_set_type'] == 'UPDATE'
+
+def test_deploy_stack_fails_for_rolled_back_stack():
+  cfn = client('cloudformation')
+  with Stubber(cfn) as stubber:
+    stubber.add_response('describe_stacks', {'Stacks': [stack('ROLLBACK_COMPLETE')]})
+    with pytest.raises(DeployError):
+      deploy_stack(cfn, 'app', TEMPLATE)
+
+def test_upload_template_puts_new_template_keyed_by_content_hash():
+  s3 = client('s3')
+  key = 'app/%s.template' % content_digest(TEMPLATE)['md5']
+  with Stubber(s3) as stubber:
+    stubber.add_client_error('head_object', service_error_code='404', http_status_code=404,
+                             expected_params={'Bucket': 'templates', 'Key': key})
+    stubber.add_response('put_object', {}, {'Bucket': 'templates', 'Key': key, 'Body': TEMPLATE.encode('utf-8')})
+    url = upload_template(s3, 'templates', '/app/', TEMPLATE)
+    stubber.assert_no_pending_responses()
+  assert url.endswith('/templates/' + key)
+
+def test_upload_template_skips_existing_template():
+  s3 = client('s3')
+  with Stubber(s3) as stubber:
+    stubber.add_response('head_object', {'ContentLength': len(TEMPLATE)})
+    upload_template(s3, 'templates', 'app', TEMPLATE)
+    stubber.assert_no_pending_responses()
+
+def test_upload_template_raises_other_errors():
+  s3 = client('s3')
+  with Stubber(s3) as stubber:
+    stubber.add_client_error('head_object', service_error_code='403', http_status_code=403)
+    with pytest.raises(ClientError):
+      upload_template(s3, 'templates', 'app', TEMPLATE)
+
+def test_content_digest_of_encoded_content():
+  digest = content_digest(u'Description: caf\xe9\n')
+  assert digest['size'] == 19
+  assert digest == content_digest(u'Description: caf\xe9\n'.encode('utf-8'))
+  assert digest['md5'] != content_digest(u'Description: cafe\n')['md5']
+
+def collect(cache_path, status='UPDATE_COMPLETE', list_resources=True):
+  cfn = client('cloudformation')
+  with Stubber(cfn) as stubber:
+    stubber.add_response('describe_stacks', {'Stacks': [dict(stack(status), Outputs=[{'OutputKey': 'Url', 'OutputValue': 'x'}])]})
+    if list_resources:
+      stubber.add_response('list_stack_resources', {'StackResourceSummaries': [{
+        'LogicalResourceId': 'Topic', 'PhysicalResourceId': 'topic-1', 'ResourceType': 'AWS::SNS::Topic',
+        'LastUpdatedTimestamp': NOW, 'ResourceStatus': 'CREATE_COMPLETE'
+      }]})
+    facts, cached = collect_stack_facts(cfn, ['app'], str(cache_path))
+    stubber.assert_no_pending_responses()
+  assert facts['app']['stack_resources'] == {'Topic': 'topic-1'}
+  assert facts['app']['stack_outputs'] == {'Url': 'x'}
+  return cached
+
+def test_collect_stack_facts_caches_resources(tmpdir):
+  assert collect(tmpdir) == []
+  assert collect(tmpdir, list_resources=False) == ['app']
+
+def test_collect_stack_facts_lists_resources_of_updated_stack(tmpdir):
+  collect(tmpdir)
+  assert collect(tmpdir, status='UPDATE_ROLLBACK_COMPLETE') == []
+
+def test_collect_stack_facts_rewrites_corrupt_cache(tmpdir):
+  collect(tmpdir)
+  cache_file = tmpdir.join('app.json')
+  cache_file.write(cache_file.read()[:10])
+  assert collect(tmpdir) == []
+  assert collect(tmpdir, list_resources=False) == ['app']
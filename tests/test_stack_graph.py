@@ -0,0 +1,106 @@
+import json
+import pytest
+
+from stack_graph import (StackGraphError, Unresolved, find_stacks, resolve_name, stack_dependencies, stack_plan,
+                         stack_references, stack_waves)
+import cfn_plan
+
+def exporter(name, export):
+  return {
+    'Resources': {'Topic': {'Type': 'AWS::SNS::Topic'}},
+    'Outputs': {name: {'Value': {'Ref': 'Topic'}, 'Export': {'Name': export}}}
+  }
+
+def importer(*names):
+  return {'Resources': dict(
+    ('Queue%d' % i, {'Type': 'AWS::SQS::Queue', 'Properties': {'QueueName': {'Fn::ImportValue': name}}})
+    for i, name in enumerate(names)
+  )}
+
+def importer_exporter(imports, name, export):
+  body = exporter(name, export)
+  body['Resources'].update(importer(*imports)['Resources'])
+  return body
+
+def write_stacks(folder, stacks, env='dev'):
+  for name, body in stacks.items():
+    folder.join('%s-%s-stack.yml' % (env, name)).write(json.dumps(body))
+  return str(folder)
+
+def test_resolve_name_substitutes_known_values():
+  values = {'Env': 'dev', 'AWS::StackName': 'network', 'Zones': ['a', 'b']}
+  assert resolve_name('Literal', values) == 'Literal'
+  assert resolve_name({'Ref': 'Zones'}, values) == 'a,b'
+  assert resolve_name({'Fn::Sub': '${AWS::StackName}-${Env}-VpcId'}, values) == 'network-dev-VpcId'
+  assert resolve_name({'Fn::Sub': ['${Prefix}-Id', {'Prefix': {'Ref': 'Env'}}]}, values) == 'dev-Id'
+  assert resolve_name({'Fn::Sub': '${!Literal}-${Env}'}, values) == '${Literal}-dev'
+  assert resolve_name({'Fn::Join': ['-', [{'Ref': 'Env'}, 'VpcId']]}, values) == 'dev-VpcId'
+
+def test_resolve_name_fails_for_deploy_time_values():
+  with pytest.raises(Unresolved):
+    resolve_name({'Fn::Sub': '${AWS::AccountId}-VpcId'}, {})
+  with pytest.raises(Unresolved):
+    resolve_name({'Fn::GetAtt': ['Vpc', 'CidrBlock']}, {})
+
+def test_stack_references_resolves_parameters_and_defaults():
+  body = {
+    'Parameters': {'Env': {'Type': 'String', 'Default': 'dev'}, 'Network': {'Type': 'String'}},
+    'Resources': {'Queue': {'Properties': {
+      'Vpc': {'Fn::ImportValue': {'Fn::Sub': '${Network}-VpcId'}},
+      'Account': {'Fn::ImportValue': {'Fn::Sub': '${AWS::AccountId}-Id'}}
+    }}},
+    'Outputs': {'Url': {'Value': 'x', 'Export': {'Name': {'Fn::Sub': '${AWS::StackName}-${Env}-Url'}}}}
+  }
+  references = stack_references('app', body, {'Network': 'network'})
+  assert references['exports'] == ['app-dev-Url']
+  assert references['imports'] == ['network-VpcId']
+  assert references['unresolved'] == ['import ${AWS::AccountId}']
+
+def test_stack_dependencies_ignores_external_and_own_exports():
+  references = {
+    'network': {'exports': ['VpcId'], 'imports': ['AccountId']},
+    'app': {'exports': ['Url'], 'imports': ['VpcId', 'Url']}
+  }
+  assert stack_dependencies(references) == {'network': [], 'app': ['network']}
+
+def test_stack_dependencies_fails_on_duplicate_export():
+  with pytest.raises(StackGraphError) as e:
+    stack_dependencies({'a': {'exports': ['VpcId'], 'imports': []}, 'b': {'exports': ['VpcId'], 'imports': []}})
+  assert 'VpcId' in str(e.value)
+
+def test_stack_waves_orders_stacks_by_dependencies():
+  dependencies = {'network': [], 'security': ['network'], 'db': ['network', 'security'], 'app': ['db'], 'dns': []}
+  assert stack_waves(dependencies) == [['dns', 'network'], ['security'], ['db'], ['app']]
+
+def test_stack_waves_reports_cycle():
+  with pytest.raises(StackGraphError) as e:
+    stack_waves({'network': [], 'a': ['network', 'c'], 'b': ['a'], 'c': ['b']})
+  assert str(e.value) == 'Stack dependency cycle: a -> c -> b -> a'
+
+def test_stack_plan_of_build_folder(tmpdir):
+  folder = write_stacks(tmpdir, {
+    'network': exporter('VpcId', 'VpcId'),
+    'app': importer('VpcId', 'DbUrl', 'ExistingId'),
+    'db': importer_exporter(['VpcId'], 'DbUrl', 'DbUrl')
+  })
+  tmpdir.join('uat-other-stack.yml').write(json.dumps(importer('VpcId')))
+  stacks = find_stacks([folder], 'dev')
+  assert sorted(stacks) == ['app', 'db', 'network']
+  plan = stack_plan(stacks)
+  assert plan['waves'] == [['network'], ['db'], ['app']]
+  assert plan['stacks']['app']['dependencies'] == ['db', 'network']
+  assert plan['stacks']['app']['external'] == ['ExistingId']
+
+def test_cfn_plan_prints_waves(tmpdir, capsys):
+  folder = write_stacks(tmpdir, {'network': exporter('VpcId', 'VpcId'), 'app': importer('VpcId')})
+  assert cfn_plan.main(['-e', 'dev', folder]) == 0
+  lines = capsys.readouterr().out.splitlines()
+  assert [line.split('=')[0] for line in lines] == ['wave 1: network', 'wave 2: app']
+
+def test_cfn_plan_fails_on_cycle(tmpdir, capsys):
+  folder = write_stacks(tmpdir, {
+    'a': importer_exporter(['B'], 'A', 'A'),
+    'b': importer_exporter(['A'], 'B', 'B')
+  })
+  assert cfn_plan.main(['-e', 'dev', folder]) == 1
+  assert 'Stack dependency cycle: a -> b -> a' in capsys.readouterr().err
@@ -0,0 +1,108 @@
+import copy
+import json
+import pytest
+
+from stack_optimize import MAPPING_KEY, compact_length, mapping_key, stack_optimize
+
+DESCRIPTION = 'Allow HTTPS from the corporate network and the partner VPN ranges'
+
+def template(groups=12):
+  return {
+    'AWSTemplateFormatVersion': '2010-09-09',
+    'Parameters': {'Env': {'Type': 'String', 'Default': 'dev'}},
+    'Mappings': {
+      'Sizes': {'dev': {'Instance': 't3.micro'}, 'prod': {'Instance': 'm5.large'}},
+      'Unused': {'dev': {'Value': 'x'}}
+    },
+    'Conditions': {
+      'IsProd': {'Fn::Equals': [{'Ref': 'Env'}, 'prod']},
+      'IsNotProd': {'Fn::Not': [{'Condition': 'IsProd'}]},
+      'IsUnused': {'Fn::Equals': [{'Ref': 'Env'}, 'uat']}
+    },
+    'Metadata': {},
+    'Resources': dict(
+      ('Group%d' % i, {
+        'Type': 'AWS::EC2::SecurityGroup',
+        'Properties': {
+          'GroupDescription': DESCRIPTION,
+          'SecurityGroupIngress': [
+            {'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'CidrIp': '10.100.0.0/16', 'Description': DESCRIPTION},
+            {'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'CidrIp': '172.16.0.0/12', 'Description': DESCRIPTION}
+          ],
+          'Tags': [
+            {'Key': 'Name', 'Value': {'Fn::If': ['IsNotProd', 'non-production-security-group', 'production-security-group']}},
+            {'Key': 'InstanceType', 'Value': {'Fn::FindInMap': ['Sizes', {'Ref': 'Env'}, 'Instance']}}
+          ]
+        }
+      }) for i in range(groups)
+    ),
+    'Outputs': {}
+  }
+
+# Replaces Fn::FindInMap references to hoisted literal mappings with the literal
+def expand(node, mappings):
+  if isinstance(node, dict):
+    if list(node) == ['Fn::FindInMap'] and node['Fn::FindInMap'][0] in mappings:
+      name, key, attribute = node['Fn::FindInMap']
+      return mappings[name][key][attribute]
+    return dict((k, expand(v, mappings)) for k, v in node.items())
+  if isinstance(node, list):
+    return [expand(v, mappings) for v in node]
+  return node
+
+def lint_rules(data):
+  api = pytest.importorskip('cfnlint.api')
+  return set(m.rule.id for m in api.lint(json.dumps(data), config=api.ManualArgs(regions=['us-east-1'])))
+
+def test_removes_unused_conditions_mappings_and_empty_sections():
+  optimized = stack_optimize(template(1), hoist=False)
+  assert sorted(optimized['Conditions']) == ['IsNotProd', 'IsProd']
+  assert sorted(optimized['Mappings']) == ['Sizes']
+  assert 'Metadata' not in optimized and 'Outputs' not in optimized
+
+def test_keeps_mappings_referenced_by_name_expressions():
+  data = template(1)
+  data['Resources']['Group0']['Properties']['Tags'][1]['Value']['Fn::FindInMap'][0] = {'Ref': 'Env'}
+  assert sorted(stack_optimize(data, hoist=False)['Mappings']) == ['Sizes', 'Unused']
+
+def test_hoists_repeated_literals_into_mappings():
+  data = template()
+  optimized = stack_optimize(data)
+  literals = [name for name in optimized['Mappings'] if name.startswith('Lit')]
+  assert literals == ['Lit0']
+  hoisted = optimized['Mappings']['Lit0'][MAPPING_KEY]
+  # Literals shorter than a Fn::FindInMap reference are left in place
+  assert list(hoisted.values()) == [DESCRIPTION]
+  assert optimized['Resources']['Group0']['Properties']['SecurityGroupIngress'][0]['CidrIp'] == '10.100.0.0/16'
+  assert compact_length(optimized) < compact_length(stack_optimize(data, hoist=False))
+  resources = expand(optimized['Resources'], dict((name, optimized['Mappings'][name]) for name in literals))
+  assert resources == data['Resources']
+
+def test_does_not_hoist_intrinsic_function_arguments():
+  optimized = stack_optimize(template())
+  tags = optimized['Resources']['Group0']['Properties']['Tags']
+  assert tags[0]['Value']['Fn::If'][0] == 'IsNotProd'
+  assert tags[1]['Value'] == {'Fn::FindInMap': ['Sizes', {'Ref': 'Env'}, 'Instance']}
+
+def test_does_not_hoist_literals_in_templates_with_transform():
+  data = dict(template(), Transform='AWS::Serverless-2016-10-31')
+  assert not [name for name in stack_optimize(data)['Mappings'] if name.startswith('Lit')]
+
+def test_does_not_modify_input():
+  data = template()
+  original = copy.deepcopy(data)
+  stack_optimize(data)
+  assert data == original
+
+def test_mapping_keys_are_unique_alphanumeric():
+  keys = [mapping_key(i) for i in range(200)]
+  assert len(set(keys)) == 200
+  assert all(key.isalnum() for key in keys)
+
+def test_optimized_template_passes_the_same_lint_rules():
+  data = template()
+  optimized = stack_optimize(data)
+  assert [name for name in optimized['Mappings'] if name.startswith('Lit')]
+  # The unused condition (W8001) and unused mapping (W7001) warnings are resolved, and no new findings are introduced
+  assert lint_rules(data) == set(['W7001', 'W8001'])
+  assert lint_rules(optimized) == set()
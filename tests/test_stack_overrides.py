@@ -0,0 +1,73 @@
+import copy
+import pytest
+
+pytest.importorskip('jmespath')
+from stack_overrides import PLANS, override_plan, stack_overrides
+
+STACK = {
+  'Parameters': {
+    'Env': {'Type': 'String', 'AllowedValues': ['dev']}
+  },
+  'Resources': {
+    'Topic': {
+      'Type': 'AWS::SNS::Topic',
+      'Properties': {
+        'Subscription': [
+          {'Protocol': 'sqs', 'Endpoint': 'queue'},
+          {'Protocol': 'lambda', 'Endpoint': 'function'}
+        ],
+        'Tags': [{'Key': 'Name', 'Value': 'topic'}]
+      }
+    }
+  }
+}
+
+def test_override_plan_orders_selectors_by_section_and_depth():
+  selectors = [
+    'Stack.Resources.Topic.Properties.Tags[0]',
+    'Stack.Outputs.Arn[]',
+    'Stack.Resources.Topic.Type[]',
+    'Stack.Parameters.Env.AllowedValues[]',
+    "Stack.Resources.Topic.Properties.Subscription[?Protocol=='sqs']",
+    'Stack.Resources.*.DeletionPolicy'
+  ]
+  plan = override_plan(selectors)
+  assert [(step[0], step[1]) for step in plan] == [
+    ('Stack.Parameters.Env.AllowedValues[]', 'append'),
+    ('Stack.Resources.Topic.Type[]', 'append'),
+    ('Stack.Resources.*.DeletionPolicy', 'assign'),
+    ('Stack.Resources.Topic.Properties.Tags[0]', 'index'),
+    ("Stack.Resources.Topic.Properties.Subscription[?Protocol=='sqs']", 'filter'),
+    ('Stack.Outputs.Arn[]', 'append')
+  ]
+
+def test_override_plan_is_cached_per_selector_set():
+  PLANS.clear()
+  selectors = ['Stack.Resources.Topic.Properties.Tags[0]', 'Stack.Parameters.Env.AllowedValues[]']
+  plan = override_plan(selectors)
+  assert override_plan(list(selectors)) is plan
+  assert override_plan(selectors, paths=['Resources']) is not plan
+  assert len(PLANS) == 2
+
+def test_stack_overrides_applies_selectors():
+  variables = {
+    'Stack': copy.deepcopy(STACK),
+    'Stack.Parameters.Env.AllowedValues[]': ['uat', 'prod'],
+    'Stack.Resources.Topic.Properties.Tags[0]': {'Key': 'Name', 'Value': 'renamed'},
+    "Stack.Resources.Topic.Properties.Subscription[?Protocol=='sqs']": {'Protocol': 'sqs', 'Endpoint': 'other'},
+    'Stack.Resources.*.DeletionPolicy': 'Retain',
+    'Stack.Resources.Topic.Properties.TopicName': 'ignored'
+  }
+  result = stack_overrides(variables)
+  assert result['Parameters']['Env']['AllowedValues'] == ['dev', 'uat', 'prod']
+  assert result['Resources']['Topic'] == {
+    'Type': 'AWS::SNS::Topic',
+    'DeletionPolicy': 'Retain',
+    'Properties': {
+      'Subscription': [
+        {'Protocol': 'sqs', 'Endpoint': 'other'},
+        {'Protocol': 'lambda', 'Endpoint': 'function'}
+      ],
+      'Tags': [{'Key': 'Name', 'Value': 'renamed'}]
+    }
+  }
@@ -0,0 +1,237 @@
+import datetime
+import os
+import pytest
+import yaml
+from jinja2.defaults import DEFAULT_FILTERS
+
+pytest.importorskip('ansible')
+from ansible.parsing.utils.yaml import from_yaml
+from stack_transforms import (
+  AnsibleFilters, fix_conditions, render_template, search_and_replace, stack_merge, stack_transform, to_stack_yaml
+)
+
+TAGGED_YAML = '''
+Count: 9
+Ratio: 1.5
+Enabled: true
+Date: 2020-01-02
+Timestamp: 2020-01-02 03:04:05
+Name: topic
+Empty: null
+Tags: [a, b]
+Properties: {Port: 443}
+'''
+
+PLAIN = {
+  'Count': 9,
+  'Ratio': 1.5,
+  'Enabled': True,
+  'Date': datetime.date(2020, 1, 2),
+  'Timestamp': datetime.datetime(2020, 1, 2, 3, 4, 5),
+  'Name': 'topic',
+  'Empty': None,
+  'Tags': ['a', 'b'],
+  'Properties': {'Port': 443}
+}
+
+def test_to_stack_yaml_represents_tagged_ansible_values():
+  data = from_yaml(TAGGED_YAML, file_name=os.path.abspath('stack.yml'))
+  assert data == PLAIN
+  assert to_stack_yaml(data) == to_stack_yaml(PLAIN)
+  assert yaml.safe_load(to_stack_yaml(data)) == PLAIN
+
+def test_to_stack_yaml_represents_unsafe_text():
+  wrap_var = pytest.importorskip('ansible.utils.unsafe_proxy').wrap_var
+  assert to_stack_yaml(wrap_var({'Name': 'topic', 'Tags': ['a']}), indent=2) == 'Name: topic\nTags:\n- a\n'
+
+class FilterPlugin(object):
+  def __init__(self, loaded, **filters):
+    self.loaded = loaded
+    self.plugin_filters = filters
+
+  def filters(self):
+    self.loaded.append(sorted(self.plugin_filters))
+    return self.plugin_filters
+
+def test_ansible_filters_override_builtins_and_last_plugin_wins():
+  loaded = []
+  plugins = [FilterPlugin(loaded, upper=len, combine=min), FilterPlugin(loaded, combine=max)]
+  filters = AnsibleFilters(plugins)
+  assert loaded == []
+  assert filters['upper'] is len
+  assert filters.get('combine') is max
+  assert 'lower' in filters and 'missing' not in filters
+  assert filters.get('missing', sum) is sum
+  assert loaded == [['combine', 'upper'], ['combine']]
+
+def test_ansible_filters_keep_builtins_for_filters_of_the_ansible_template_engine():
+  def ansible_default(value, default_value=''):
+    return value
+  ansible_default.accept_args_markers = True
+  filters = AnsibleFilters([FilterPlugin([], default=ansible_default, d=ansible_default, mandatory=ansible_default)])
+  assert filters['default'] is DEFAULT_FILTERS['default'] and filters['d'] is DEFAULT_FILTERS['d']
+  assert filters['mandatory'] is ansible_default
+
+KEY_TEMPLATE = '''
+Parameters:
+  Alias:
+    Type: String
+  Retain:
+    Type: String
+    Default: 'false'
+Conditions:
+  Retained:
+    Fn::Equals: [{Ref: Retain}, 'true']
+Resources:
+  Key:
+    Type: AWS::KMS::Key
+    Properties:
+      Description: {Fn::Sub: '${AWS::StackName} ${Alias} key'}
+  KeyAlias:
+    Type: AWS::KMS::Alias
+    Condition: Retained
+    DependsOn: [Key]
+    Properties:
+      AliasName: {Fn::Sub: 'alias/${Alias}'}
+      TargetKeyId: {Ref: Key}
+Outputs:
+  KeyArn:
+    Value: {Fn::GetAtt: [Key, Arn]}
+  KeyId:
+    Value: {Ref: Key}
+'''
+
+TOPIC_TEMPLATE = '''
+Metadata:
+  Stack::Transform:
+    DefaultDependencyMappings: [Topic]
+Parameters:
+  Name:
+    Type: String
+  KmsKeyId:
+    Type: String
+Resources:
+  Topic:
+    Type: AWS::SNS::Topic
+    Properties:
+      TopicName: {Fn::Sub: '${AWS::StackName}-${Name}'}
+      KmsMasterKeyId: {Ref: KmsKeyId}
+  Policy:
+    Type: AWS::SNS::TopicPolicy
+    DependsOn: [Topic]
+    Properties:
+      Topics: [{Ref: Topic}]
+      PolicyDocument: {Fn::Sub: '{"Resource": "${Topic}", "Name": "${Name}", "Key": "${KmsKeyId}"}'}
+Outputs:
+  TopicArn:
+    Value: {Ref: Topic}
+  TopicName:
+    Value: {Fn::GetAtt: [Topic, TopicName]}
+'''
+
+# The Topic transform references an output of the Key transform, which is replaced once the Topic transform is merged
+STACK = '''
+Parameters:
+  Env:
+    Type: String
+Resources:
+  Topic:
+    Type: Stack::Transform
+    Template: topic.yml.j2
+    DependsOn: [Queue]
+    Properties:
+      Name: {Ref: Env}
+      KmsKeyId: {Ref: Key.KeyId}
+  Key:
+    Type: Stack::Transform
+    Template: key.yml.j2
+    Properties:
+      Alias: {Fn::Sub: '${Env}-key'}
+  Queue:
+    Type: AWS::SQS::Queue
+    Properties:
+      KmsMasterKeyId: {Fn::GetAtt: [Key, KeyArn]}
+  Subscription:
+    Type: AWS::SNS::Subscription
+    DependsOn: [Topic, Queue]
+    Properties:
+      TopicArn: {Ref: Topic.TopicArn}
+      Endpoint: {Fn::Sub: '${Queue.Arn} ${Topic.TopicName} ${Key.KeyArn}'}
+Outputs:
+  Topic:
+    Value: {Fn::GetAtt: [Topic, TopicArn]}
+  Key:
+    Value: {Fn::Sub: '${Key.KeyId}'}
+'''
+
+@pytest.fixture
+def template_path(tmp_path):
+  tmp_path.joinpath('key.yml.j2').write_text(KEY_TEMPLATE)
+  tmp_path.joinpath('topic.yml.j2').write_text(TOPIC_TEMPLATE)
+  return str(tmp_path)
+
+# Transforms a stack by walking the entire stack for every search and replace, as stack_transform did before
+# references were indexed
+def walk_transform(data, template_path):
+  transforms = [
+    {
+      'name': resource_key,
+      'resource': resource_value,
+      'output': render_template(resource_value['Template'], template_path, resource_value)
+    }
+    for resource_key, resource_value in data['Resources'].items()
+    if resource_value.get('Type') == 'Stack::Transform'
+  ]
+  for transform in transforms:
+    name = transform['name']
+    for key in transform['output'].get('Outputs', {}).keys():
+      search_and_replace(data, '%s.%s' % (name, key), name+key)
+      search_and_replace(data, {'Fn::GetAtt': [name,key]}, {'Ref': name+key})
+  for transform in transforms:
+    name, output = transform['name'], transform['output']
+    resource_properties = transform['resource']['Properties']
+    for section in ['Resources','Mappings','Conditions','Outputs']:
+      for key in list(output.get(section, {}).keys()):
+        output[section][name+key] = output[section].pop(key)
+        search_and_replace(output, key, name+key)
+    for output_param_key, output_param_value in output.get('Parameters', {}).items():
+      resource_property = resource_properties.get(output_param_key)
+      if resource_property:
+        fix_conditions(data, output, output_param_key, output_param_value, resource_property)
+    for output_param_key, output_param_value in output.get('Parameters', {}).items():
+      value = resource_properties.get(output_param_key) or output_param_value.get('Default')
+      search_and_replace(output, output_param_key, value, as_value=True)
+  for transform in transforms:
+    name, output = transform['name'], transform['output']
+    dependency_mapping = output.get('Metadata',{}).get('Stack::Transform',{}).get('DefaultDependencyMappings',[])
+    dependencies = transform['resource'].get('DependsOn')
+    for mapping in dependency_mapping:
+      if dependencies:
+        resource = output['Resources'][name+mapping]
+        resource['DependsOn'] = resource.get('DependsOn', []) + dependencies
+    for key, value in output.get('Outputs', {}).items():
+      search_and_replace(data, key, value['Value'], as_value=True)
+    data = stack_merge(data, {section: output.get(section, {}) for section in ['Resources','Mappings','Conditions']})
+    del data['Resources'][name]
+    if dependency_mapping:
+      search_and_replace(data, name, [name+mapping for mapping in dependency_mapping], as_value=True)
+  return data
+
+def test_stack_transform_matches_walked_search_and_replace(template_path):
+  expected = walk_transform(yaml.safe_load(STACK), template_path)
+  data = from_yaml(STACK, file_name=os.path.abspath('stack.yml'))
+  report = {}
+  assert stack_transform(data, template_paths=[template_path], report=report) == expected
+  assert report['counts']['walks'] == 0
+  assert sorted(expected['Resources']) == ['KeyKey', 'KeyKeyAlias', 'Queue', 'Subscription', 'TopicPolicy', 'TopicTopic']
+  assert expected['Resources']['Subscription'] == {
+    'Type': 'AWS::SNS::Subscription',
+    'DependsOn': ['Queue', 'TopicTopic'],
+    'Properties': {
+      'TopicArn': {'Ref': 'TopicTopic'},
+      'Endpoint': {'Fn::Sub': '${Queue.Arn} ${TopicTopic.TopicName} ${KeyKey.Arn}'}
+    }
+  }
+  assert expected['Resources']['TopicTopic']['DependsOn'] == ['Queue']
+  assert expected['Resources']['TopicTopic']['Properties']['KmsMasterKeyId'] == {'Ref': 'KeyKey'}
+  assert expected['Outputs'] == {'Topic': {'Value': {'Ref': 'TopicTopic'}}, 'Key': {'Value': {'Fn::Sub': '${KeyKey}'}}}
@@ -0,0 +1,102 @@
+import copy
+import pytest
+
+from ansible.errors import AnsibleFilterError
+from stack_validate import stack_reference_errors, stack_validate
+
+TEMPLATE = {
+  'Parameters': {'Env': {'Type': 'String'}},
+  'Mappings': {'Sizes': {'dev': {'Instance': 't3.micro'}}},
+  'Conditions': {
+    'IsProd': {'Fn::Equals': [{'Ref': 'Env'}, 'prod']},
+    'IsNotProd': {'Fn::Not': [{'Condition': 'IsProd'}]}
+  },
+  'Resources': {
+    'Topic': {'Type': 'AWS::SNS::Topic', 'Properties': {'TopicName': {'Fn::Sub': '${AWS::StackName}-${Env}'}}},
+    'Queue': {
+      'Type': 'AWS::SQS::Queue',
+      'Condition': 'IsNotProd',
+      'DependsOn': 'Topic',
+      'Properties': {
+        'QueueName': {'Fn::Sub': ['${Name}-${Topic.TopicName}-${!Literal}', {'Name': {'Ref': 'Topic'}}]},
+        'Tags': [
+          {'Key': 'Size', 'Value': {'Fn::FindInMap': ['Sizes', {'Ref': 'Env'}, 'Instance']}},
+          {'Key': 'Prod', 'Value': {'Fn::If': ['IsProd', 'yes', {'Ref': 'AWS::NoValue'}]}},
+          {'Key': 'Macro', 'Value': {'Fn::Transform': {'Name': 'Macro', 'Parameters': {'Ref': 'Undefined'}}}}
+        ]
+      }
+    },
+    'Subscription': {'Type': 'AWS::SNS::Subscription', 'DependsOn': ['Topic', 'Queue'], 'Properties': {
+      'TopicArn': {'Ref': 'Topic'},
+      'Endpoint': {'Fn::GetAtt': ['Queue', 'Arn']}
+    }}
+  },
+  'Outputs': {
+    'QueueArn': {'Condition': 'IsNotProd', 'Value': {'Fn::GetAtt': 'Queue.Arn'}}
+  }
+}
+
+def errors(path, value):
+  data = copy.deepcopy(TEMPLATE)
+  parent = data
+  for key in path[:-1]:
+    parent = parent[key]
+  parent[path[-1]] = value
+  return stack_reference_errors(data)
+
+def test_valid_template_has_no_errors():
+  assert stack_reference_errors(TEMPLATE) == []
+  assert stack_validate(TEMPLATE) is TEMPLATE
+
+@pytest.mark.parametrize('path,value,error', [
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Ref': 'Missing'},
+   'Resources.Topic.Properties.TopicName.Ref: Ref to undefined parameter or resource Missing'),
+  (['Conditions', 'IsProd'], {'Fn::Equals': [{'Ref': 'Topic'}, 'x']},
+   'Conditions.IsProd.Fn::Equals[0].Ref: Ref to resource Topic is not allowed in conditions'),
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Fn::GetAtt': ['Missing', 'Arn']},
+   'Resources.Topic.Properties.TopicName.Fn::GetAtt: Fn::GetAtt references undefined resource Missing'),
+  (['Outputs', 'QueueArn', 'Value'], {'Fn::GetAtt': 'Missing.Arn'},
+   'Outputs.QueueArn.Value.Fn::GetAtt: Fn::GetAtt references undefined resource Missing'),
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Fn::Sub': '${Missing.Arn}'},
+   'Resources.Topic.Properties.TopicName.Fn::Sub: Fn::Sub variable ${Missing.Arn} is not a parameter, resource or Fn::Sub variable'),
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Fn::Sub': ['${Name}', {'Name': {'Ref': 'Missing'}}]},
+   'Resources.Topic.Properties.TopicName.Fn::Sub[1].Name.Ref: Ref to undefined parameter or resource Missing'),
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Fn::FindInMap': ['Missing', 'dev', 'Instance']},
+   'Resources.Topic.Properties.TopicName.Fn::FindInMap: Fn::FindInMap references undefined mapping Missing'),
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Fn::FindInMap': ['Sizes', 'prod', 'Instance']},
+   'Resources.Topic.Properties.TopicName.Fn::FindInMap: Fn::FindInMap key prod is not defined in mapping Sizes'),
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Fn::FindInMap': ['Sizes', 'dev', 'Memory']},
+   'Resources.Topic.Properties.TopicName.Fn::FindInMap: Fn::FindInMap key dev.Memory is not defined in mapping Sizes'),
+  (['Resources', 'Topic', 'Properties', 'TopicName'], {'Fn::If': ['Missing', 'a', 'b']},
+   'Resources.Topic.Properties.TopicName.Fn::If[0]: Condition Missing is not defined'),
+  (['Conditions', 'IsNotProd'], {'Fn::Not': [{'Condition': 'Missing'}]},
+   'Conditions.IsNotProd.Fn::Not[0].Condition: Condition Missing is not defined'),
+  (['Resources', 'Queue', 'Condition'], 'Missing',
+   'Resources.Queue.Condition: Condition Missing is not defined'),
+  (['Outputs', 'QueueArn', 'Condition'], 'Missing',
+   'Outputs.QueueArn.Condition: Condition Missing is not defined'),
+  (['Resources', 'Queue', 'DependsOn'], 'Missing',
+   'Resources.Queue.DependsOn: DependsOn references undefined resource Missing'),
+  (['Resources', 'Subscription', 'DependsOn'], ['Topic', 'Subscription'],
+   'Resources.Subscription.DependsOn[1]: Resource depends on itself')
+])
+def test_reports_invalid_references(path, value, error):
+  assert errors(path, value) == [error]
+
+def test_fails_with_all_errors():
+  data = copy.deepcopy(TEMPLATE)
+  data['Resources']['Topic']['DependsOn'] = 'Missing'
+  data['Resources']['Subscription']['Properties']['TopicArn'] = {'Ref': 'Gone'}
+  with pytest.raises(AnsibleFilterError) as e:
+    stack_validate(data)
+  assert 'Template has 2 invalid references' in str(e.value)
+  assert 'Resources.Topic.DependsOn: DependsOn references undefined resource Missing' in str(e.value)
+  assert 'Resources.Subscription.Properties.TopicArn.Ref: Ref to undefined parameter or resource Gone' in str(e.value)
+
+def test_does_not_validate_templates_with_transform():
+  data = dict(copy.deepcopy(TEMPLATE), Transform='AWS::Serverless-2016-10-31')
+  data['Resources']['Function'] = {'Type': 'AWS::Serverless::Function', 'Properties': {'Role': {'Ref': 'FunctionRole'}}}
+  assert stack_reference_errors(data) == []
+
+def test_reports_resources_that_are_not_dictionaries():
+  assert errors(['Resources', 'Topic'], 'AWS::SNS::Topic') == ['Resources.Topic: Resource must be a dictionary']
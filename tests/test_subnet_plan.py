@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip('netaddr')
+from ansible.errors import AnsibleFilterError
+from subnet_plan import subnet_plan
+
+def test_allocates_subnets_by_tier_then_zone():
+  plan = subnet_plan('10.0.0.0/16', ['public', 'private'], az_count=2)
+  assert [(s['tier'], s['zone'], s['index'], s['cidr']) for s in plan['subnets']] == [
+    ('public', 'a', 0, '10.0.0.0/24'),
+    ('public', 'b', 1, '10.0.1.0/24'),
+    ('private', 'a', 2, '10.0.2.0/24'),
+    ('private', 'b', 3, '10.0.3.0/24')
+  ]
+  assert plan['tiers']['private'] == {'cidrs': ['10.0.2.0/24', '10.0.3.0/24'], 'supernets': ['10.0.2.0/23']}
+  assert plan['dns_server'] == '10.0.0.2'
+  assert plan['capacity'] == 256
+
+def test_supernets_of_unaligned_tiers():
+  plan = subnet_plan('10.0.0.0/16', ['public', 'private'], az_count=3, size=20)
+  assert plan['tiers']['private']['cidrs'] == ['10.0.48.0/20', '10.0.64.0/20', '10.0.80.0/20']
+  assert plan['tiers']['private']['supernets'] == ['10.0.48.0/20', '10.0.64.0/19']
+
+def test_normalizes_vpc_cidr():
+  assert subnet_plan('10.0.5.0/16', ['public'], az_count=1)['vpc_cidr'] == '10.0.0.0/16'
+
+def test_plan_that_exactly_fits_the_vpc():
+  plan = subnet_plan('10.0.0.0/24', ['public', 'private'], az_count=2, size=26)
+  assert plan['subnets'][-1]['cidr'] == '10.0.0.192/26'
+
+def test_fails_when_subnets_do_not_fit_the_vpc():
+  with pytest.raises(AnsibleFilterError) as e:
+    subnet_plan('10.0.0.0/24', ['public', 'medium', 'high'], az_count=3, size=26)
+  assert str(e.value).startswith('Subnet plan of 9 /26 subnets (3 tiers in 3 availability zones) does not fit in VPC 10.0.0.0/24')
+
+@pytest.mark.parametrize('vpc_cidr,az_count,size', [
+  ('not-a-cidr', 2, 24),
+  ('10.0.0.0/16', 0, 24),
+  ('10.0.0.0/16', 27, 24),
+  ('10.0.0.0/16', 2, 8),
+  ('10.0.0.0/16', 2, 33)
+])
+def test_fails_for_invalid_arguments(vpc_cidr, az_count, size):
+  with pytest.raises(AnsibleFilterError):
+    subnet_plan(vpc_cidr, ['public'], az_count=az_count, size=size)
+
+def test_returns_a_copy_of_cached_plans():
+  plan = subnet_plan('10.1.0.0/16', ['public'])
+  plan['subnets'].pop()
+  assert len(subnet_plan('10.1.0.0/16', ['public'])['subnets']) == 2
+
+def test_allocates_ipv6_subnets():
+  plan = subnet_plan('2001:db8::/56', ['public'], az_count=2, size=64)
+  assert [s['cidr'] for s in plan['subnets']] == ['2001:db8::/64', '2001:db8:0:1::/64']
+  assert plan['capacity'] == 256